@@ -25,12 +25,17 @@
 
 import baostock as bs
 import pandas as pd
+import numpy as np
 from pathlib import Path
 from datetime import datetime, timedelta
 from tqdm import tqdm
 import logging
 import time
 import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from download_utils import format_date_strings, read_latest_date
 
 # ============================================================
 # 配置
@@ -53,6 +58,10 @@ END_DATE = datetime.now().strftime('%Y-%m-%d')  # 结束日期（今天）
 MAX_RETRIES = 3
 RETRY_DELAY = 2
 BATCH_SIZE = 50
+MAX_WORKERS = 16  # 并发处理股票的线程数（读写parquet、合并并行；Baostock请求串行）
+
+# Baostock 使用全局单连接，多线程同时请求会串包，RPC部分必须加锁串行
+BAOSTOCK_LOCK = threading.Lock()
 
 # 增量更新配置
 INCREMENTAL_CONFIG = {
@@ -88,32 +97,17 @@ def add_market_prefix(pure_code):
     else:
         return f'sz.{pure_code}'
 
-def extract_pure_code(code_with_prefix):
-    """提取纯数字股票代码"""
-    if pd.isna(code_with_prefix):
-        return None
-    code_str = str(code_with_prefix)
-    if '.' in code_str:
-        return code_str.split('.')[1]
-    return code_str
-
-def format_date_string(date_value):
-    """格式化日期为 YYYY-MM-DD 字符串"""
-    if pd.isna(date_value):
-        return None
-    try:
-        if isinstance(date_value, str):
-            if len(date_value) == 10 and date_value[4] == '-' and date_value[7] == '-':
-                return date_value
-        dt = pd.to_datetime(date_value)
-        return dt.strftime('%Y-%m-%d')
-    except:
-        return None
+def extract_pure_codes(codes):
+    """提取纯数字股票代码（整列处理）：'sh.600000' -> '600000'，无前缀的保持原样"""
+    return codes.astype(str).str.split('.', n=1).str.get(-1).where(codes.notna())
 
-def calculate_derived_fields(df):
+def calculate_derived_fields(df, presorted=False):
     """
     计算派生字段
     
+    前提：昨收由 shift(1) 推算，要求数据按日期升序排列；
+    调用方已排好序时传 presorted=True 跳过重复的排序
+    
     新增字段：
     - 涨跌额：收盘 - 昨收
     - 振幅：(最高 - 最低) / 昨收 * 100
@@ -125,7 +119,8 @@ def calculate_derived_fields(df):
         return df
     
     # 确保数据按日期排序
-    df = df.sort_values('日期').reset_index(drop=True)
+    if not presorted:
+        df = df.sort_values('日期').reset_index(drop=True)
     
     # 如果API没有提供昨收，使用前一天的收盘价计算
     if '昨收' not in df.columns or df['昨收'].isna().all():
@@ -138,15 +133,22 @@ def calculate_derived_fields(df):
     df['振幅'] = ((df['最高'] - df['最低']) / df['昨收'] * 100).round(4)
     
     # 判断涨跌幅异常（涨跌幅超过±10%，或ST股超过±5%）
-    df['涨跌幅异常'] = df['涨跌幅'].apply(
-        lambda x: 'X' if (pd.notna(x) and (abs(x) > 10)) else None
-    )
+    # 整列向量化判断，NaN比较结果为False，自然得到None
+    df['涨跌幅异常'] = np.where(df['涨跌幅'].abs() > 10, 'X', None)
     
     # 停牌判断（成交量为0视为停牌）
-    df['停牌'] = df['成交量'].apply(lambda x: 'X' if (pd.notna(x) and x == 0) else None)
+    df['停牌'] = np.where(df['成交量'].fillna(-1) == 0, 'X', None)
     
     return df
 
+def get_latest_date(stock_code):
+    """获取现有数据的最新日期（只读parquet footer，见 download_utils.read_latest_date）"""
+    try:
+        return read_latest_date(OUTPUT_DIR / f"{stock_code}.parquet")
+    except Exception as e:
+        logger.error(f"{stock_code}: 读取最新日期失败 - {e}")
+        return None
+
 def get_existing_data(stock_code):
     """
     读取现有数据
@@ -283,7 +285,7 @@ def download_kline_data(stock_code, start_date=None, end_date=None, retry_count=
         df = df.rename(columns=column_mapping)
         
         # 提取纯数字代码
-        df['股票代码'] = df['代码'].apply(extract_pure_code)
+        df['股票代码'] = extract_pure_codes(df['代码'])
         df = df.drop(columns=['代码'])
         
         # 转换数据类型
@@ -296,7 +298,7 @@ def download_kline_data(stock_code, start_date=None, end_date=None, retry_count=
             df['成交量'] = pd.to_numeric(df['成交量'], errors='coerce').astype('Int64')
         
         # 格式化日期
-        df['日期'] = df['日期'].apply(format_date_string)
+        df['日期'] = format_date_strings(df['日期'])
         
         # 删除无效行
         df = df.dropna(subset=['日期', '收盘'])
@@ -319,6 +321,30 @@ def download_kline_data(stock_code, start_date=None, end_date=None, retry_count=
             logger.error(f"{stock_code}: 下载异常 - {e}")
             return None
 
+# 判断新数据是否带来变化时比较的原始字段
+RAW_COLUMNS = ['开盘', '最高', '最低', '收盘', '昨收', '成交量', '成交额', '换手率', '涨跌幅', 'ST标记']
+
+def has_new_data(df_existing, df_new):
+    """
+    新下载的数据是否带来变化（出现新交易日，或回溯区间内已有交易日的数值被修正）
+    
+    没有变化时无需重算派生字段、备份和重写整个parquet文件
+    """
+    if df_existing is None or df_existing.empty:
+        return True
+    if df_new is None or df_new.empty:
+        return False
+    
+    existing_dates = pd.to_datetime(df_existing['日期']).dt.strftime('%Y-%m-%d')
+    if not df_new['日期'].isin(existing_dates).all():
+        return True
+    
+    columns = [col for col in RAW_COLUMNS if col in df_new.columns and col in df_existing.columns]
+    in_overlap = existing_dates.isin(df_new['日期'])
+    overlap = df_existing.loc[in_overlap, columns].set_index(existing_dates[in_overlap])
+    new_rows = df_new[columns].set_index(df_new['日期'])
+    return not overlap.sort_index().equals(new_rows.sort_index())
+
 def merge_data(df_existing, df_new, stock_code, stock_info):
     """
     合并现有数据和新下载的数据
@@ -358,8 +384,8 @@ def merge_data(df_existing, df_new, stock_code, stock_info):
         # If not datetime type, convert first then format
         df_result['日期'] = pd.to_datetime(df_result['日期']).dt.strftime('%Y-%m-%d')
     
-    # 重新计算派生字段（确保完整性）
-    df_result = calculate_derived_fields(df_result)
+    # 重新计算派生字段（确保完整性）；两个分支得到的数据都已按日期排序
+    df_result = calculate_derived_fields(df_result, presorted=True)
     
     # 确保股票代码正确
     df_result['股票代码'] = stock_code
@@ -393,7 +419,7 @@ def get_stock_list_from_baostock():
         
         df = pd.DataFrame(stock_list, columns=rs.fields)
         df = df[df['code'].str.contains(r'(sh\.[65]|sz\.[03])', na=False)]
-        df['pure_code'] = df['code'].apply(extract_pure_code)
+        df['pure_code'] = extract_pure_codes(df['code'])
         
         # 过滤退市股票
         if 'status' in df.columns:
@@ -493,6 +519,62 @@ def validate_turnover_field(df, stock_code):
     
     return True
 
+def process_one(stock_code, stock_info):
+    """
+    处理单只股票：读取现有数据 → 下载 → 合并 → 保存
+    
+    返回: (状态, 新增记录数)，状态为 'updated' / 'skipped' / 'failed'
+    """
+    # 读取现有数据的最新日期（只读footer）
+    latest_date = get_latest_date(stock_code)
+    
+    # 计算下载范围
+    start_date, end_date, need_download = calculate_download_range(latest_date, stock_code)
+    
+    if not need_download:
+        return 'skipped', 0
+    
+    # 下载新数据（Baostock请求串行）
+    with BAOSTOCK_LOCK:
+        df_new = download_kline_data(stock_code, start_date, end_date)
+    
+    if df_new is None:
+        return 'failed', 0
+    
+    # 确实需要合并时才读取完整的现有数据
+    df_existing = None
+    if latest_date is not None:
+        df_existing, _ = get_existing_data(stock_code)
+        # footer可读但完整读取失败：不能用回溯区间的数据覆盖整个历史文件
+        if df_existing is None:
+            logger.error(f"{stock_code}: 现有数据读取失败，跳过更新以免覆盖历史数据")
+            return 'failed', 0
+    
+    # 回溯区间内没有新交易日也没有数据修正：保持现有文件不动，不再全量重写
+    if not has_new_data(df_existing, df_new):
+        return 'skipped', 0
+    
+    # 备份
+    if INCREMENTAL_CONFIG['backup_before_update'] and df_existing is not None:
+        file_path = OUTPUT_DIR / f"{stock_code}.parquet"
+        backup_file(file_path)
+    
+    # 合并数据
+    df_final = merge_data(df_existing, df_new, stock_code, stock_info)
+    
+    if df_final is None or df_final.empty:
+        return 'failed', 0
+    
+    # 验证换手率字段
+    validate_turnover_field(df_final, stock_code)
+    
+    # 保存（每只股票一个文件，线程间无需加锁）
+    output_file = OUTPUT_DIR / f"{stock_code}.parquet"
+    df_final.to_parquet(output_file, index=False)
+    
+    new_records = len(df_new) if not df_new.empty else 0
+    return 'updated', new_records
+
 # ============================================================
 # 主程序
 # ============================================================
@@ -557,51 +639,20 @@ def main():
     print(f"\n步骤 4/4: 增量更新K线数据...")
     print(f"提示：只下载缺失的交易日数据，并自动计算派生字段\n")
     
-    with tqdm(total=len(stock_codes), desc="更新进度") as pbar:
-        for i, stock_code in enumerate(stock_codes):
-            # 读取现有数据
-            df_existing, latest_date = get_existing_data(stock_code)
-            
-            # 计算下载范围
-            start_date, end_date, need_download = calculate_download_range(latest_date, stock_code)
-            
-            if not need_download:
-                stats['skipped'] += 1
-                pbar.update(1)
-                continue
-            
-            # 备份
-            if INCREMENTAL_CONFIG['backup_before_update'] and df_existing is not None:
-                file_path = OUTPUT_DIR / f"{stock_code}.parquet"
-                backup_file(file_path)
-            
-            # 下载新数据
-            df_new = download_kline_data(stock_code, start_date, end_date)
-            
-            if df_new is None:
-                stats['failed'] += 1
-                pbar.update(1)
-                continue
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor, \
+            tqdm(total=len(stock_codes), desc="更新进度") as pbar:
+        futures = {executor.submit(process_one, stock_code, stock_info): stock_code
+                   for stock_code in stock_codes}
+        
+        for i, future in enumerate(as_completed(futures)):
+            try:
+                status, new_records = future.result()
+            except Exception as e:
+                logger.error(f"{futures[future]}: 处理异常 - {e}")
+                status, new_records = 'failed', 0
             
-            # 合并数据
-            df_final = merge_data(df_existing, df_new, stock_code, stock_info)
-            
-            if df_final is None or df_final.empty:
-                stats['failed'] += 1
-                pbar.update(1)
-                continue
-            
-            # 验证换手率字段
-            validate_turnover_field(df_final, stock_code)
-            
-            # 保存
-            output_file = OUTPUT_DIR / f"{stock_code}.parquet"
-            df_final.to_parquet(output_file, index=False)
-            
-            new_records = len(df_new) if not df_new.empty else 0
+            stats[status] += 1
             stats['new_records'] += new_records
-            stats['updated'] += 1
-            
             pbar.update(1)
             
             # 每处理一批显示统计
@@ -627,7 +678,7 @@ def main():
     print("=" * 80)
     print(f"总股票数: {stats['total']}")
     print(f"✅ 已更新: {stats['updated']}")
-    print(f"⏭️  已跳过: {stats['skipped']} (数据已是最新)")
+    print(f"⏭️  已跳过: {stats['skipped']} (数据已是最新或无变化)")
     print(f"❌ 更新失败: {stats['failed']}")
     print(f"📊 新增记录: {stats['new_records']} 条")
     print("=" * 80)
@@ -15,12 +15,21 @@
 
 import baostock as bs
 import pandas as pd
+import numpy as np
+import pyarrow.parquet as pq
 from pathlib import Path
 from datetime import datetime, timedelta
 from tqdm import tqdm
 import logging
 import time
+import os
+import random
 import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from numba_kernels import derive_daily_fields
+from download_utils import format_date_strings, read_latest_date, read_rows, to_float_array, write_parquet_atomic
 
 # ============================================================
 # 配置
@@ -45,6 +54,48 @@ END_DATE = datetime.now().strftime('%Y-%m-%d')  # 结束日期（今天）
 MAX_RETRIES = 3
 RETRY_DELAY = 2
 BATCH_SIZE = 50
+MAX_WORKERS = 8  # 并发处理的线程数（读写parquet、合并并行；Baostock请求串行）
+
+# Baostock字段 → 中文列名
+COLUMN_MAPPING = {
+    'date': '日期',
+    'open': '开盘',
+    'high': '最高',
+    'low': '最低',
+    'close': '收盘',
+    'preclose': '昨收',
+    'volume': '成交量',
+    'amount': '成交额',
+    'turn': '换手率',
+    'pctChg': '涨跌幅',
+    'isST': 'ST标记'
+}
+
+# 查询字段只拼接一次
+BAOSTOCK_FIELDS = ','.join(COLUMN_MAPPING)
+
+# Baostock "用户未登录" 错误码（会话失效）
+BAOSTOCK_NOT_LOGGED_IN = '10001001'
+
+# 转为float64的列（成交量单独转为Int64）
+NUMERIC_COLUMNS = ['开盘', '最高', '最低', '收盘', '昨收', '成交额', '换手率', '涨跌幅']
+
+# parquet写入参数：zstd压缩；取值很少的字符串列用字典编码；单个row group约容纳全部历史日线
+PARQUET_WRITE_OPTIONS = {
+    'compression': 'zstd',
+    'compression_level': 3,
+    'use_dictionary': ['股票代码', '股票名称', 'ST标记', '涨跌幅异常', '停牌'],
+    'row_group_size': 8192,
+}
+
+# 结果验证时展示的列
+DISPLAY_COLS = ['日期', '开盘', '收盘', '涨跌额', '涨跌幅', '振幅', '昨收']
+
+# Baostock 使用全局单连接，多线程同时请求会串包，RPC部分必须加锁串行
+BAOSTOCK_LOCK = threading.Lock()
+
+# 复权类型 -> 数据目录
+ADJUST_DIRS = {'qfq': QFQ_DATA_DIR, 'hfq': HFQ_DATA_DIR}
 
 # 增量更新配置
 INCREMENTAL_CONFIG = {
@@ -80,23 +131,13 @@ def add_market_prefix(pure_code):
     else:
         return f'sz.{pure_code}'
 
-def format_date_string(date_value):
-    """格式化日期为 YYYY-MM-DD 字符串"""
-    if pd.isna(date_value):
-        return None
-    try:
-        if isinstance(date_value, str):
-            if len(date_value) == 10 and date_value[4] == '-' and date_value[7] == '-':
-                return date_value
-        dt = pd.to_datetime(date_value)
-        return dt.strftime('%Y-%m-%d')
-    except:
-        return None
-
-def calculate_derived_fields(df):
+def calculate_derived_fields(df, presorted=False):
     """
     计算派生字段
     
+    前提：昨收取前一行收盘，要求数据按日期升序排列；
+    调用方已排好序时传 presorted=True 跳过重复的排序
+    
     新增字段：
     - 涨跌额：收盘 - 昨收
     - 振幅：(最高 - 最低) / 昨收 * 100
@@ -106,32 +147,41 @@ def calculate_derived_fields(df):
         return df
     
     # 确保数据按日期排序
-    df = df.sort_values('日期').reset_index(drop=True)
-    
-    # 计算昨收（前一天的收盘价）
-    df['昨收'] = df['收盘'].shift(1)
-    
-    # 计算涨跌额
-    df['涨跌额'] = df['收盘'] - df['昨收']
-    
-    # 计算振幅
-    df['振幅'] = ((df['最高'] - df['最低']) / df['昨收'] * 100).round(4)
-    
-    # 判断涨跌幅异常（涨跌幅超过±10%，或ST股超过±5%）
-    # 简化版本：涨跌幅 > 10% 或 < -10% 标记为异常
-    df['涨跌幅异常'] = df['涨跌幅'].apply(
-        lambda x: 'X' if (pd.notna(x) and (abs(x) > 10)) else None
+    if not presorted:
+        df = df.sort_values('日期', ignore_index=True)
+    
+    # 所有派生字段由一个编译内核一次遍历算出（见 numba_kernels.derive_daily_fields）
+    # 涨跌幅异常简化为 |涨跌幅| > 10%（未区分ST股的±5%）；停牌为成交量为0
+    prev_close, change, amplitude, abnormal, halted = derive_daily_fields(
+        df['收盘'].to_numpy(dtype=np.float64),
+        df['最高'].to_numpy(dtype=np.float64),
+        df['最低'].to_numpy(dtype=np.float64),
+        df['涨跌幅'].to_numpy(dtype=np.float64),
+        df['成交量'].to_numpy(dtype=np.float64, na_value=np.nan),
     )
     
-    # 停牌判断（成交量为0视为停牌）
-    df['停牌'] = df['成交量'].apply(lambda x: 'X' if (pd.notna(x) and x == 0) else None)
+    df['昨收'] = prev_close
+    df['涨跌额'] = change
+    df['振幅'] = amplitude
+    df['涨跌幅异常'] = np.where(abnormal, 'X', None)
+    df['停牌'] = np.where(halted, 'X', None)
     
     return df
 
-def get_existing_data(stock_code, data_dir):
+def get_latest_date(stock_code, data_dir):
+    """获取现有数据的最新日期（只读parquet footer，见 download_utils.read_latest_date）"""
+    try:
+        return read_latest_date(data_dir / f"{stock_code}.parquet")
+    except Exception as e:
+        logger.error(f"{stock_code}: 读取最新日期失败 - {e}")
+        return None
+
+def get_existing_data(stock_code, data_dir, columns=None):
     """
     读取现有数据
     
+    columns: 只读取这些列（文件中不存在的列忽略），None 为读取全部列
+    
     返回: (DataFrame, 最新日期)
     """
     file_path = data_dir / f"{stock_code}.parquet"
@@ -140,14 +190,20 @@ def get_existing_data(stock_code, data_dir):
         return None, None
     
     try:
-        df = pd.read_parquet(file_path)
+        if columns is not None:
+            available = set(pq.read_schema(file_path).names)
+            columns = [col for col in columns if col in available]
+        df = pd.read_parquet(file_path, columns=columns)
         
         if df.empty:
             return None, None
         
+        # 日期统一为 YYYY-MM-DD 字符串（与下载数据一致，按字典序即按时间排序），已是该格式时不再转换
+        if not df['日期'].astype(str).str.fullmatch(r'\d{4}-\d{2}-\d{2}').all():
+            df['日期'] = format_date_strings(df['日期'])
+        
         # 获取最新日期
-        df['日期'] = pd.to_datetime(df['日期'])
-        latest_date = df['日期'].max().strftime('%Y-%m-%d')
+        latest_date = df['日期'].max()
         
         logger.debug(f"{stock_code}: 现有数据 {len(df)} 条，最新日期 {latest_date}")
         
@@ -189,7 +245,55 @@ def calculate_download_range(latest_date, stock_code):
     
     return start_date, END_DATE, True
 
-def download_adjusted_data(stock_code, adjust_type='qfq', start_date=None, end_date=None, retry_count=0):
+def relogin():
+    """会话失效后重新登录 Baostock（Baostock 是进程内唯一的全局会话，不能按线程各自登录）"""
+    try:
+        bs.logout()
+    except Exception:
+        pass
+    lg = bs.login()
+    if lg.error_code != '0':
+        logger.warning(f"重新登录失败: {lg.error_msg}")
+
+def query_adjusted_rows(bs_code, stock_code, adjustflag, start_date, end_date):
+    """
+    调用 Baostock 查询复权K线，失败时按指数退避重试（RETRY_DELAY * 2^n 秒 + 随机抖动）
+    
+    返回: (字段列表, 行数据数组) 或 None
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            # 请求所有可用字段
+            rs = bs.query_history_k_data_plus(
+                code=bs_code,
+                fields=BAOSTOCK_FIELDS,
+                start_date=start_date,
+                end_date=end_date,
+                frequency="d",
+                adjustflag=adjustflag
+            )
+            
+            if rs.error_code == '0':
+                return rs.fields, read_rows(rs, start_date, end_date)
+            
+            error = rs.error_msg
+            session_lost = rs.error_code == BAOSTOCK_NOT_LOGGED_IN
+        except Exception as e:
+            # 连接异常后会话通常已失效
+            error = e
+            session_lost = True
+        
+        if attempt < MAX_RETRIES:
+            logger.debug(f"{stock_code}: 下载失败，重试 {attempt + 1}/{MAX_RETRIES} - {error}")
+            time.sleep(RETRY_DELAY * 2 ** attempt + random.uniform(0, 0.5))
+            # 重试沿用 main() 登录的全局会话，只有会话失效时才重新登录（调用方持有 BAOSTOCK_LOCK）
+            if session_lost:
+                relogin()
+    
+    logger.error(f"{stock_code}: 下载失败 - {error}")
+    return None
+
+def download_adjusted_data(stock_code, adjust_type='qfq', start_date=None, end_date=None):
     """
     下载单只股票的复权数据
     
@@ -198,7 +302,6 @@ def download_adjusted_data(stock_code, adjust_type='qfq', start_date=None, end_d
         adjust_type: 'qfq' (前复权) 或 'hfq' (后复权)
         start_date: 开始日期
         end_date: 结束日期
-        retry_count: 当前重试次数
     
     返回: 
         DataFrame 或 None
@@ -216,67 +319,31 @@ def download_adjusted_data(stock_code, adjust_type='qfq', start_date=None, end_d
         # 设置复权参数
         adjustflag = '2' if adjust_type == 'qfq' else '1'  # 2=前复权, 1=后复权
         
-        # 调用 Baostock API - 请求所有可用字段
-        rs = bs.query_history_k_data_plus(
-            code=bs_code,
-            fields="date,open,high,low,close,preclose,volume,amount,turn,pctChg,isST",
-            start_date=start_date,
-            end_date=end_date,
-            frequency="d",
-            adjustflag=adjustflag
-        )
-        
-        # 检查返回状态
-        if rs.error_code != '0':
-            if retry_count < MAX_RETRIES:
-                logger.debug(f"{stock_code}: 下载失败，重试 {retry_count + 1}/{MAX_RETRIES}")
-                time.sleep(RETRY_DELAY)
-                return download_adjusted_data(stock_code, adjust_type, start_date, end_date, retry_count + 1)
-            else:
-                logger.debug(f"{stock_code}: {rs.error_msg}")
-                return None
-        
-        # 收集数据
-        data_list = []
-        while (rs.error_code == '0') & rs.next():
-            data_list.append(rs.get_row_data())
+        # 调用 Baostock API（只有这一步重试）
+        result = query_adjusted_rows(bs_code, stock_code, adjustflag, start_date, end_date)
+        if result is None:
+            return None
+        fields, rows = result
         
         # 检查是否有数据
-        if not data_list:
+        if len(rows) == 0:
             logger.debug(f"{stock_code}: 无复权数据")
             return pd.DataFrame()  # 返回空DataFrame
         
-        # 转换为 DataFrame
-        df = pd.DataFrame(data_list, columns=rs.fields)
-        
-        # 重命名列
-        column_mapping = {
-            'date': '日期',
-            'open': '开盘',
-            'high': '最高',
-            'low': '最低',
-            'close': '收盘',
-            'preclose': '昨收',
-            'volume': '成交量',
-            'amount': '成交额',
-            'turn': '换手率',
-            'pctChg': '涨跌幅',
-            'isST': 'ST标记'
-        }
-        
-        df = df.rename(columns=column_mapping)
-        
-        # 转换数据类型
-        numeric_columns = ['开盘', '最高', '最低', '收盘', '昨收', '成交额', '换手率', '涨跌幅']
-        for col in numeric_columns:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-        
-        if '成交量' in df.columns:
-            df['成交量'] = pd.to_numeric(df['成交量'], errors='coerce').astype('Int64')
+        # 逐列一次性转换为目标类型，直接构造DataFrame（不经过全字符串的中间DataFrame）
+        columns = {}
+        for field, values in zip(fields, rows.T):
+            col = COLUMN_MAPPING.get(field, field)
+            if col in NUMERIC_COLUMNS:
+                columns[col] = to_float_array(values)
+            elif col == '成交量':
+                columns[col] = pd.array(to_float_array(values)).astype('Int64')
+            else:
+                columns[col] = np.array(values, dtype=object)
+        df = pd.DataFrame(columns)
         
         # 格式化日期
-        df['日期'] = df['日期'].apply(format_date_string)
+        df['日期'] = format_date_strings(df['日期'])
         
         # 删除无效行
         df = df.dropna(subset=['日期'])
@@ -291,74 +358,89 @@ def download_adjusted_data(stock_code, adjust_type='qfq', start_date=None, end_d
         return df
     
     except Exception as e:
-        if retry_count < MAX_RETRIES:
-            logger.debug(f"{stock_code}: 异常，重试 {retry_count + 1}/{MAX_RETRIES} - {e}")
-            time.sleep(RETRY_DELAY)
-            return download_adjusted_data(stock_code, adjust_type, start_date, end_date, retry_count + 1)
-        else:
-            logger.error(f"{stock_code}: 下载异常 - {e}")
-            return None
+        logger.error(f"{stock_code}: 处理数据异常 - {e}")
+        return None
+
+# 下载得到的原始数值列（昨收由 calculate_derived_fields 按前一行收盘重算，不参与比较）
+RAW_COLUMNS = ['开盘', '最高', '最低', '收盘', '成交量', '成交额', '换手率', '涨跌幅', 'ST标记']
+
+def has_new_data(df_existing, df_new):
+    """
+    新下载的数据是否带来变化（出现新交易日，或回溯区间内已有交易日的数值被修正）
+    
+    没有变化时无需合并、备份和重写整个parquet文件
+    """
+    if df_existing is None or df_existing.empty:
+        return True
+    if df_new is None or df_new.empty:
+        return False
+    
+    existing_dates = df_existing['日期']
+    if not df_new['日期'].isin(existing_dates).all():
+        return True
+    
+    columns = [col for col in RAW_COLUMNS if col in df_new.columns and col in df_existing.columns]
+    in_overlap = existing_dates.isin(df_new['日期'])
+    overlap = df_existing.loc[in_overlap, columns].set_index(existing_dates[in_overlap])
+    new_rows = df_new[columns].set_index(df_new['日期'])
+    return not overlap.sort_index().equals(new_rows.sort_index())
+
+# 合并时从现有文件读取的列：派生字段由编译内核一次遍历重算，股票代码合并后重新赋值，均不必读取
+MERGE_READ_COLUMNS = ['日期'] + RAW_COLUMNS + ['股票名称']
+
+# 固定放在最后的标识列
+TRAILING_COLUMNS = ['股票代码', '股票名称']
 
-def merge_data(df_existing, df_new, stock_code, stock_info):
+def merge_data(df_existing, df_new, stock_code, name_map):
     """
     合并现有数据和新下载的数据
     
     策略：
-    1. 合并两个DataFrame
-    2. 按日期去重（保留新数据）
-    3. 重新计算所有派生字段（确保数据一致性）
-    4. 排序
-    5. 添加股票信息
+    1. 按日期去重（剔除现有数据中被新数据覆盖的日期）
+    2. 合并两个DataFrame
+    3. 排序
+    4. 重新计算派生字段（现有数据只读取了原始列）
+    5. 添加股票信息，列顺序与新下载数据一致
     """
     if df_existing is None or df_existing.empty:
         df_result = df_new
     elif df_new is None or df_new.empty:
         return df_existing
     else:
-        # 确保日期格式一致
-        df_existing['日期'] = pd.to_datetime(df_existing['日期'])
-        df_new['日期'] = pd.to_datetime(df_new['日期'])
+        # 去重（保留最新的）：先剔除现有数据中与新数据重复的日期，再合并，无需对整张表做 drop_duplicates
+        mask = ~df_existing['日期'].isin(df_new['日期'].values)
+        df_result = pd.concat([df_existing[mask], df_new], ignore_index=True)
         
-        # 合并
-        df_result = pd.concat([df_existing, df_new], ignore_index=True)
-        
-        # 去重（保留最新的）
-        df_result = df_result.drop_duplicates(subset=['日期'], keep='last')
-        
-        # 排序
-        df_result = df_result.sort_values('日期').reset_index(drop=True)
-    
-    # 转换日期回字符串
-    df_result['日期'] = df_result['日期'].dt.strftime('%Y-%m-%d')
+        # 排序：增量数据通常整体晚于保留的旧数据，合并结果已有序时跳过排序（不再多复制一份）
+        if not df_result['日期'].is_monotonic_increasing:
+            df_result = df_result.sort_values('日期', ignore_index=True)
     
-    # 重新计算派生字段（确保完整性）
-    df_result = calculate_derived_fields(df_result)
+    # 重新计算派生字段（已排序）
+    df_result = calculate_derived_fields(df_result, presorted=True)
     
     # 添加股票代码
     df_result['股票代码'] = stock_code
     
-    # 添加股票名称
-    if stock_info is not None:
-        stock_row = stock_info[stock_info['股票代码'] == stock_code]
-        if not stock_row.empty:
-            df_result['股票名称'] = stock_row['股票名称'].iloc[0]
+    # 添加股票名称（name_map 为 股票代码 → 股票名称 的字典；查不到时保留现有数据中的名称）
+    if name_map is not None and stock_code in name_map:
+        df_result['股票名称'] = name_map[stock_code]
     
-    return df_result
+    # 列顺序：新下载数据的列（含派生字段）在前，股票代码、股票名称在最后
+    trailing = [col for col in TRAILING_COLUMNS if col in df_result.columns]
+    leading = [col for col in df_new.columns if col not in trailing]
+    return df_result[leading + trailing]
+
+def list_parquet_stems(directory):
+    """列出目录下parquet文件名（不含扩展名）；os.scandir 一次读出目录项，不逐个stat"""
+    if not directory.exists():
+        return set()
+    with os.scandir(directory) as entries:
+        return {entry.name[:-len('.parquet')] for entry in entries if entry.name.endswith('.parquet')}
 
 def get_stock_list():
     """获取需要处理的股票列表"""
-    # 优先从已有数据中获取
-    stock_codes = set()
-    
-    # 从前复权目录获取
-    if QFQ_DATA_DIR.exists():
-        qfq_files = list(QFQ_DATA_DIR.glob("*.parquet"))
-        stock_codes.update([f.stem for f in qfq_files])
-    
-    # 从后复权目录获取
-    if HFQ_DATA_DIR.exists():
-        hfq_files = list(HFQ_DATA_DIR.glob("*.parquet"))
-        stock_codes.update([f.stem for f in hfq_files])
+    # 优先从已有数据中获取（前复权、后复权目录）
+    stock_codes = list_parquet_stems(QFQ_DATA_DIR) | list_parquet_stems(HFQ_DATA_DIR)
     
     # 如果没有已有数据，从股票信息文件获取
     if not stock_codes and STOCK_INFO_FILE.exists():
@@ -394,6 +476,10 @@ def load_stock_info():
         logger.error(f"❌ 加载股票信息失败: {e}")
         return None
 
+def save_parquet(df, file_path):
+    """按 PARQUET_WRITE_OPTIONS 写入parquet：先写临时文件再原子替换，旧文件（及其硬链接备份）内容保持不变"""
+    write_parquet_atomic(df, file_path, PARQUET_WRITE_OPTIONS)
+
 def backup_file(file_path):
     """备份单个文件"""
     if not file_path.exists():
@@ -409,19 +495,73 @@ def backup_file(file_path):
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         backup_file = backup_subdir / f"{stock_code}_{timestamp}.parquet"
         
-        # 复制文件
-        shutil.copy2(file_path, backup_file)
+        # 硬链接代替复制（只增加一个目录项，不读写文件内容）；
+        # save_parquet 总是写新文件再替换，不会改动备份指向的旧文件。跨设备等不支持时退回复制
+        try:
+            os.link(file_path, backup_file)
+        except OSError:
+            shutil.copy2(file_path, backup_file)
         logger.debug(f"已备份: {backup_file}")
         
         # 清理旧备份（保留最近3个）
-        backups = sorted(backup_subdir.glob(f"{stock_code}_*.parquet"), reverse=True)
-        for old_backup in backups[3:]:
+        # 文件名中的时间戳可直接按字典序排序
+        backups = sorted((name for name in list_parquet_stems(backup_subdir) if name.startswith(f"{stock_code}_")), reverse=True)
+        for old_name in backups[3:]:
+            old_backup = backup_subdir / f"{old_name}.parquet"
             old_backup.unlink()
             logger.debug(f"删除旧备份: {old_backup}")
     
     except Exception as e:
         logger.warning(f"备份失败: {e}")
 
+def process_one(stock_code, adjust_type, name_map, writer):
+    """
+    处理单只股票的一种复权数据：读取现有数据 → 下载 → 合并 → 交给写入线程保存
+    
+    返回: (状态, 新增记录数, 写入任务)，状态为 'updated' / 'skipped' / 'failed'，写入任务为 Future 或 None
+    """
+    data_dir = ADJUST_DIRS[adjust_type]
+    
+    # 读取现有数据的最新日期（只读footer）
+    latest_date = get_latest_date(stock_code, data_dir)
+    start_date, end_date, need_download = calculate_download_range(latest_date, stock_code)
+    
+    if not need_download:
+        return 'skipped', 0, None
+    
+    # 下载新数据（Baostock请求串行）
+    with BAOSTOCK_LOCK:
+        df_new = download_adjusted_data(stock_code, adjust_type, start_date, end_date)
+    
+    if df_new is None:
+        return 'failed', 0, None
+    
+    # 确实需要合并时才读取完整的现有数据
+    df_existing = None
+    if latest_date is not None:
+        df_existing, _ = get_existing_data(stock_code, data_dir, columns=MERGE_READ_COLUMNS)
+        # footer可读但完整读取失败：不能用回溯区间的数据覆盖整个历史文件
+        if df_existing is None:
+            logger.error(f"{stock_code}: 现有数据读取失败，跳过更新以免覆盖历史数据")
+            return 'failed', 0, None
+    
+    # 回溯区间内没有新交易日也没有数据修正：保持现有文件不动，不再全量重写
+    if not has_new_data(df_existing, df_new):
+        return 'skipped', 0, None
+    
+    # 备份
+    if INCREMENTAL_CONFIG['backup_before_update'] and df_existing is not None:
+        backup_file(data_dir / f"{stock_code}.parquet")
+    
+    # 合并数据
+    df_final = merge_data(df_existing, df_new, stock_code, name_map)
+    
+    # 保存由单个写入线程顺序完成，工作线程不等待写盘，直接处理下一个任务
+    pending_write = writer.submit(save_parquet, df_final, data_dir / f"{stock_code}.parquet")
+    
+    new_records = len(df_new) if not df_new.empty else 0
+    return 'updated', new_records, pending_write
+
 # ============================================================
 # 主程序
 # ============================================================
@@ -462,6 +602,11 @@ def main():
     else:
         print(f"⚠️  未加载股票信息，股票名称字段将为空")
     
+    # 代码 → 名称 字典只构建一次，每只股票O(1)查找（重复代码取第一条）
+    name_map = None
+    if stock_info is not None:
+        name_map = stock_info.drop_duplicates('股票代码').set_index('股票代码')['股票名称'].to_dict()
+    
     # 登录 Baostock
     print("\n步骤 3/5: 登录 Baostock...")
     lg = bs.login()
@@ -489,64 +634,28 @@ def main():
     print(f"\n步骤 4/5: 增量更新复权数据...")
     print(f"提示：只下载缺失的交易日数据，并自动计算派生字段\n")
     
-    with tqdm(total=len(stock_codes), desc="更新进度") as pbar:
-        for i, stock_code in enumerate(stock_codes):
-            # === 处理前复权数据 ===
-            df_qfq_existing, latest_qfq_date = get_existing_data(stock_code, QFQ_DATA_DIR)
-            start_date, end_date, need_download = calculate_download_range(latest_qfq_date, stock_code)
-            
-            if need_download:
-                # 备份
-                if INCREMENTAL_CONFIG['backup_before_update'] and df_qfq_existing is not None:
-                    qfq_file = QFQ_DATA_DIR / f"{stock_code}.parquet"
-                    backup_file(qfq_file)
-                
-                # 下载新数据
-                df_qfq_new = download_adjusted_data(stock_code, 'qfq', start_date, end_date)
-                
-                if df_qfq_new is not None:
-                    # 合并数据
-                    df_qfq_final = merge_data(df_qfq_existing, df_qfq_new, stock_code, stock_info)
-                    
-                    # 保存
-                    output_file = QFQ_DATA_DIR / f"{stock_code}.parquet"
-                    df_qfq_final.to_parquet(output_file, index=False)
-                    
-                    new_records = len(df_qfq_new) if not df_qfq_new.empty else 0
-                    stats['new_records'] += new_records
-                    stats['qfq_updated'] += 1
-                else:
-                    stats['qfq_failed'] += 1
-            else:
-                stats['qfq_skipped'] += 1
-            
-            # === 处理后复权数据 ===
-            df_hfq_existing, latest_hfq_date = get_existing_data(stock_code, HFQ_DATA_DIR)
-            start_date, end_date, need_download = calculate_download_range(latest_hfq_date, stock_code)
+    # 每只股票的前复权、后复权各为一个任务；parquet写入集中到单独的一个写入线程
+    pending_writes = {}
+    with ThreadPoolExecutor(max_workers=1) as writer, \
+            ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor, \
+            tqdm(total=len(stock_codes) * len(ADJUST_DIRS), desc="更新进度") as pbar:
+        futures = {executor.submit(process_one, stock_code, adjust_type, name_map, writer): (stock_code, adjust_type)
+                   for stock_code in stock_codes for adjust_type in ADJUST_DIRS}
+        
+        for i, future in enumerate(as_completed(futures)):
+            stock_code, adjust_type = futures[future]
+            try:
+                status, new_records, pending_write = future.result()
+            except Exception as e:
+                logger.error(f"{stock_code} ({adjust_type}): 处理异常 - {e}")
+                status, new_records, pending_write = 'failed', 0, None
             
-            if need_download:
-                # 备份
-                if INCREMENTAL_CONFIG['backup_before_update'] and df_hfq_existing is not None:
-                    hfq_file = HFQ_DATA_DIR / f"{stock_code}.parquet"
-                    backup_file(hfq_file)
-                
-                # 下载新数据
-                df_hfq_new = download_adjusted_data(stock_code, 'hfq', start_date, end_date)
-                
-                if df_hfq_new is not None:
-                    # 合并数据
-                    df_hfq_final = merge_data(df_hfq_existing, df_hfq_new, stock_code, stock_info)
-                    
-                    # 保存
-                    output_file = HFQ_DATA_DIR / f"{stock_code}.parquet"
-                    df_hfq_final.to_parquet(output_file, index=False)
-                    
-                    stats['hfq_updated'] += 1
-                else:
-                    stats['hfq_failed'] += 1
-            else:
-                stats['hfq_skipped'] += 1
+            if pending_write is not None:
+                pending_writes[pending_write] = (stock_code, adjust_type, new_records)
             
+            stats[f'{adjust_type}_{status}'] += 1
+            if adjust_type == 'qfq':
+                stats['new_records'] += new_records
             pbar.update(1)
             
             # 每处理一批显示统计
@@ -557,6 +666,17 @@ def main():
                     '新增': stats['new_records']
                 })
     
+    # 等待写入完成；写盘失败的任务计为失败
+    for pending_write, (stock_code, adjust_type, new_records) in pending_writes.items():
+        try:
+            pending_write.result()
+        except Exception as e:
+            logger.error(f"{stock_code} ({adjust_type}): 保存失败 - {e}")
+            stats[f'{adjust_type}_updated'] -= 1
+            stats[f'{adjust_type}_failed'] += 1
+            if adjust_type == 'qfq':
+                stats['new_records'] -= new_records
+    
     # 退出登录
     bs.logout()
     logger.info("已退出 Baostock")
@@ -576,11 +696,11 @@ def main():
     print(f"总股票数: {stats['total']}")
     print(f"\n前复权数据:")
     print(f"  ✅ 已更新: {stats['qfq_updated']}")
-    print(f"  ⏭️  已跳过: {stats['qfq_skipped']} (数据已是最新)")
+    print(f"  ⏭️  已跳过: {stats['qfq_skipped']} (数据已是最新或无变化)")
     print(f"  ❌ 更新失败: {stats['qfq_failed']}")
     print(f"\n后复权数据:")
     print(f"  ✅ 已更新: {stats['hfq_updated']}")
-    print(f"  ⏭️  已跳过: {stats['hfq_skipped']} (数据已是最新)")
+    print(f"  ⏭️  已跳过: {stats['hfq_skipped']} (数据已是最新或无变化)")
     print(f"  ❌ 更新失败: {stats['hfq_failed']}")
     print(f"\n📊 新增记录: {stats['new_records']} 条")
     print("=" * 80)
@@ -594,8 +714,7 @@ def main():
         print(f"  数据行数: {len(sample_df):,}")
         print(f"  日期范围: {sample_df['日期'].min()} 至 {sample_df['日期'].max()}")
         
-        display_cols = ['日期', '开盘', '收盘', '涨跌额', '涨跌幅', '振幅', '昨收']
-        available_cols = [col for col in display_cols if col in sample_df.columns]
+        available_cols = [col for col in DISPLAY_COLS if col in sample_df.columns]
         print(sample_df[available_cols].tail(5).to_string(index=False))
     
     print("\n🎉 复权数据增量更新完成！")
@@ -15,11 +15,20 @@
 
 import baostock as bs
 import pandas as pd
+import numpy as np
 from pathlib import Path
 from datetime import datetime, timedelta
 from tqdm import tqdm
 import logging
+import os
+import random
 import shutil
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from numba_kernels import derive_index_fields
+from download_utils import format_date_strings, read_latest_date, read_rows, to_float_array, write_parquet_atomic
 
 # ============================================================
 # 配置
@@ -43,6 +52,38 @@ DEFAULT_START_DATE = "1990-01-01"
 END_DATE = datetime.now().strftime('%Y-%m-%d')
 MAX_RETRIES = 3
 RETRY_DELAY = 2
+MAX_WORKERS = 4  # 并发处理的线程数（读写parquet、合并并行；Baostock请求串行）
+
+# Baostock 使用进程内全局会话，查询需串行
+BAOSTOCK_LOCK = threading.Lock()
+
+# Baostock字段 → 中文列名
+INDEX_COLUMN_MAPPING = {
+    'date': '日期',
+    'open': '开盘',
+    'high': '最高',
+    'low': '最低',
+    'close': '收盘',
+    'preclose': '昨收',
+    'volume': '成交量',
+    'amount': '成交额',
+    'pctChg': '涨跌幅'
+}
+
+# 需要转为数值的列
+INDEX_NUMERIC_COLUMNS = ['开盘', '最高', '最低', '收盘', '昨收', '成交量', '成交额', '涨跌幅']
+
+# parquet写入参数：zstd压缩；每个文件内取值固定或很少的字符串列用字典编码
+PARQUET_WRITE_OPTIONS = {
+    'compression': 'zstd',
+    'compression_level': 3,
+    'use_dictionary': ['指数代码', '指数名称', '波动异常'],
+    'row_group_size': 50000,
+}
+
+# 区间收益率：列名 → 交易日数
+RETURN_PERIODS = {'涨跌幅_1月': 22, '涨跌幅_3月': 66, '涨跌幅_6月': 132}
+RETURN_PERIOD_LENGTHS = np.array(list(RETURN_PERIODS.values()), dtype=np.int64)
 
 # 增量更新配置 - 优化版
 INCREMENTAL_CONFIG = {
@@ -50,9 +91,16 @@ INCREMENTAL_CONFIG = {
     'lookback_days': 10,
     'min_gap_days': 1,  # 距离最新数据<N天不更新
     'backup_before_update': True,
+    'backup_interval_days': 7,  # 写入为原子替换，不会因中途失败损坏文件；备份只为回退错误数据，每个指数每周备份一次即可
     'smart_trading_day_check': True,  # ✨ 新增：智能交易日检测
+    'force_full_recompute': False,  # 合并后重算全部历史的派生字段和周期收益率（默认只重算尾部）
+    'emit_csv': False,  # 同时输出CSV版本（下游脚本只读parquet，仅人工查看时需要）
 }
 
+# 交易日历：登录后由 load_trade_calendar 填充（交易日 YYYY-MM-DD 集合），未加载时为 None
+TRADE_CALENDAR_LOOKBACK_DAYS = 30  # 覆盖最长的节假日休市
+TRADE_DATES = None
+
 # 创建目录
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 BACKUP_DIR.mkdir(parents=True, exist_ok=True)
@@ -76,17 +124,55 @@ logger = logging.getLogger(__name__)
 # 工具函数
 # ============================================================
 
+def load_trade_calendar():
+    """
+    登录后调用：从 Baostock 读取最近一段时间的交易日历（含节假日），缓存到 TRADE_DATES
+    
+    读取失败时保持 None，is_trading_day_today 退回按周末判断
+    """
+    global TRADE_DATES
+    today = datetime.now()
+    start_date = (today - timedelta(days=TRADE_CALENDAR_LOOKBACK_DAYS)).strftime('%Y-%m-%d')
+    try:
+        rs = bs.query_trade_dates(start_date=start_date, end_date=today.strftime('%Y-%m-%d'))
+        if rs.error_code != '0':
+            logger.warning(f"读取交易日历失败，按周末判断交易日 - {rs.error_msg}")
+            return
+        trade_dates = set()
+        while (rs.error_code == '0') & rs.next():
+            calendar_date, is_trading_day = rs.get_row_data()[:2]
+            if is_trading_day == '1':
+                trade_dates.add(calendar_date)
+        TRADE_DATES = trade_dates
+        trading_day_status.cache_clear()
+    except Exception as e:
+        logger.warning(f"读取交易日历失败，按周末判断交易日 - {e}")
+
 def is_trading_day_today():
     """
     判断今天是否是交易日
     
-    简单规则：
+    已加载交易日历时按日历判断（含节假日）；否则按简单规则：
     - 周六日：非交易日
     - 工作日：可能是交易日（不考虑节假日）
     
     返回: (是否是交易日, 距离上个交易日的自然日天数)
     """
-    today = datetime.now()
+    return trading_day_status(datetime.now().strftime('%Y-%m-%d'))
+
+@lru_cache(maxsize=1)
+def trading_day_status(date_str):
+    """按日期缓存 is_trading_day_today 的结果（各指数共用；交易日历加载后清空）"""
+    today = datetime.strptime(date_str, '%Y-%m-%d')
+    
+    if TRADE_DATES:
+        if date_str in TRADE_DATES:
+            return True, 0
+        # 往前找最近的交易日
+        for days in range(1, TRADE_CALENDAR_LOOKBACK_DAYS + 1):
+            if (today - timedelta(days=days)).strftime('%Y-%m-%d') in TRADE_DATES:
+                return False, days
+    
     weekday = today.weekday()  # 0=周一, 6=周日
     
     if weekday >= 5:  # 周六或周日
@@ -97,66 +183,60 @@ def is_trading_day_today():
     # 工作日，假设是交易日
     return True, 0
 
-def format_date_string(date_value):
-    """格式化日期为 YYYY-MM-DD 字符串"""
-    if pd.isna(date_value):
-        return None
-    try:
-        if isinstance(date_value, str):
-            if len(date_value) == 10 and date_value[4] == '-' and date_value[7] == '-':
-                return date_value
-        dt = pd.to_datetime(date_value)
-        return dt.strftime('%Y-%m-%d')
-    except:
-        return None
-
-def calculate_derived_fields(df):
+def calculate_derived_fields(df, presorted=False):
     """
     计算派生字段
     
+    前提：昨收缺失时取前一行收盘、周期收益率按行数回看，要求数据按日期升序排列；
+    调用方已排好序时传 presorted=True 跳过重复的排序
+    
     新增字段：
     - 涨跌额：收盘 - 昨收
     - 振幅：(最高 - 最低) / 昨收 * 100
     - 昨收：前一天的收盘价
     - 波动异常：单日涨跌幅超过±5%
+    - 涨跌幅_1月/3月/6月：不同周期的收益率
     """
     if df.empty:
         return df
     
     # 确保数据按日期排序
-    df = df.sort_values('日期').reset_index(drop=True)
-    
-    # 如果API没有提供昨收，使用前一天的收盘价计算
-    if '昨收' not in df.columns or df['昨收'].isna().all():
-        df['昨收'] = df['收盘'].shift(1)
-    
-    # 计算涨跌额
-    df['涨跌额'] = df['收盘'] - df['昨收']
-    
-    # 计算振幅
-    df['振幅'] = ((df['最高'] - df['最低']) / df['昨收'] * 100).round(4)
-    
-    # 判断波动异常
-    df['波动异常'] = df['涨跌幅'].apply(
-        lambda x: 'X' if (pd.notna(x) and (abs(x) > 5)) else None
+    if not presorted:
+        df = df.sort_values('日期', ignore_index=True)
+    
+    # 如果API没有提供昨收，由内核按前一天的收盘价计算
+    shift_prev = '昨收' not in df.columns or df['昨收'].isna().all()
+    close = df['收盘'].to_numpy(dtype=np.float64)
+    prev_close = close if shift_prev else df['昨收'].to_numpy(dtype=np.float64)
+    
+    # 单个内核一次遍历算完全部派生字段和周期收益率，再整列写回
+    prev_close, change, amplitude, abnormal, returns = derive_index_fields(
+        close,
+        df['最高'].to_numpy(dtype=np.float64),
+        df['最低'].to_numpy(dtype=np.float64),
+        df['涨跌幅'].to_numpy(dtype=np.float64),
+        prev_close,
+        shift_prev,
+        RETURN_PERIOD_LENGTHS,
+        5.0,
     )
+    # 振幅和周期收益率是百分比，按float32存储即可；
+    # 价格、涨跌额保持float64（指数点位5位整数+4位小数，float32会丢失末位）
+    derived = {'昨收': prev_close, '涨跌额': change, '振幅': amplitude.astype(np.float32),
+               '波动异常': pd.Categorical.from_codes(np.where(abnormal, 0, -1).astype(np.int8), categories=['X'])}
+    derived.update(zip(RETURN_PERIODS, returns.astype(np.float32)))
+    for col, values in derived.items():
+        df[col] = values
     
     return df
 
-def calculate_period_returns(df):
-    """计算不同周期的收益率"""
-    df = df.copy()
-    df['日期'] = pd.to_datetime(df['日期'])
-    df = df.sort_values('日期')
-    
-    df['涨跌幅_1月'] = df['收盘'].pct_change(22) * 100
-    df['涨跌幅_3月'] = df['收盘'].pct_change(66) * 100
-    df['涨跌幅_6月'] = df['收盘'].pct_change(132) * 100
-    
-    # 转换回字符串日期
-    df['日期'] = df['日期'].dt.strftime('%Y-%m-%d')
-    
-    return df
+def get_latest_date(index_code):
+    """获取现有数据的最新日期（只读parquet footer，见 download_utils.read_latest_date）"""
+    try:
+        return read_latest_date(OUTPUT_DIR / f"{index_code}.parquet")
+    except Exception as e:
+        logger.error(f"{index_code}: 读取最新日期失败 - {e}")
+        return None
 
 def get_existing_data(index_code):
     """
@@ -175,9 +255,12 @@ def get_existing_data(index_code):
         if df.empty:
             return None, None
         
+        # 日期统一为 YYYY-MM-DD 字符串（merge_data 按字符串比较），已是该格式时不再转换
+        if not df['日期'].astype(str).str.fullmatch(r'\d{4}-\d{2}-\d{2}').all():
+            df['日期'] = format_date_strings(df['日期'])
+        
         # 获取最新日期
-        df['日期'] = pd.to_datetime(df['日期'])
-        latest_date = df['日期'].max().strftime('%Y-%m-%d')
+        latest_date = df['日期'].max()
         
         logger.debug(f"{index_code}: 现有数据 {len(df)} 条，最新日期 {latest_date}")
         
@@ -238,65 +321,72 @@ def calculate_download_range(latest_date, index_name):
     
     return start_date, END_DATE, True
 
-def download_index_data(download_code, index_name, save_code, start_date, end_date, retry_count=0):
+def query_index_rows(download_code, index_name, start_date, end_date):
+    """
+    调用 Baostock 查询指数K线，失败时按指数退避重试（RETRY_DELAY * 2^n 秒 + 随机抖动）
+    
+    返回: (字段列表, 行数据数组) 或 None
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            rs = bs.query_history_k_data_plus(
+                code=download_code,
+                fields="date,open,high,low,close,preclose,volume,amount,pctChg",
+                start_date=start_date,
+                end_date=end_date,
+                frequency="d",
+                adjustflag="3"
+            )
+            
+            if rs.error_code == '0':
+                return rs.fields, read_rows(rs, start_date, end_date)
+            
+            error = rs.error_msg
+        except Exception as e:
+            error = e
+        
+        if attempt < MAX_RETRIES:
+            logger.warning(f"{index_name}: 下载失败，重试 {attempt + 1}/{MAX_RETRIES} - {error}")
+            time.sleep(RETRY_DELAY * 2 ** attempt + random.uniform(0, 0.5))
+    
+    logger.error(f"{index_name}: {error}")
+    return None
+
+def download_index_data(download_code, index_name, save_code, start_date, end_date):
     """
     下载单个指数的历史数据
     """
     try:
         logger.info(f"下载 {index_name} ({start_date} 至 {end_date})")
         
-        rs = bs.query_history_k_data_plus(
-            code=download_code,
-            fields="date,open,high,low,close,preclose,volume,amount,pctChg",
-            start_date=start_date,
-            end_date=end_date,
-            frequency="d",
-            adjustflag="3"
-        )
-        
-        if rs.error_code != '0':
-            if retry_count < MAX_RETRIES:
-                logger.warning(f"{index_name}: 下载失败，重试 {retry_count + 1}/{MAX_RETRIES}")
-                import time
-                time.sleep(RETRY_DELAY)
-                return download_index_data(download_code, index_name, save_code, start_date, end_date, retry_count + 1)
-            else:
-                logger.error(f"{index_name}: {rs.error_msg}")
-                return None
-        
-        data_list = []
-        while (rs.error_code == '0') & rs.next():
-            data_list.append(rs.get_row_data())
+        result = query_index_rows(download_code, index_name, start_date, end_date)
+        if result is None:
+            return None
+        fields, rows = result
         
-        if not data_list:
+        if len(rows) == 0:
             logger.warning(f"{index_name}: 无数据")
             return pd.DataFrame()
         
-        df = pd.DataFrame(data_list, columns=rs.fields)
-        
-        column_mapping = {
-            'date': '日期',
-            'open': '开盘',
-            'high': '最高',
-            'low': '最低',
-            'close': '收盘',
-            'preclose': '昨收',
-            'volume': '成交量',
-            'amount': '成交额',
-            'pctChg': '涨跌幅'
-        }
-        
-        df = df.rename(columns=column_mapping)
-        
-        # 转换数值列
-        numeric_cols = ['开盘', '最高', '最低', '收盘', '昨收', '成交量', '成交额', '涨跌幅']
-        for col in numeric_cols:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
+        # 逐列一次性转换为目标类型，直接构造DataFrame（不经过全字符串的中间DataFrame）
+        columns = {}
+        for field, values in zip(fields, rows.T):
+            col = INDEX_COLUMN_MAPPING.get(field, field)
+            if col == '成交量':
+                # 与 pd.to_numeric 一致：全为整数时保持int64，有缺失时为float64
+                volume = to_float_array(values)
+                integral = not np.isnan(volume).any() and (volume == np.floor(volume)).all()
+                columns[col] = volume.astype(np.int64) if integral else volume
+            elif col in INDEX_NUMERIC_COLUMNS:
+                columns[col] = to_float_array(values)
+            else:
+                columns[col] = np.array(values, dtype=object)
+        df = pd.DataFrame(columns)
         
-        # 添加指数标识
-        df['指数代码'] = save_code
-        df['指数名称'] = index_name
+        # 添加指数标识（整列取值相同，用只有一个类别的category存储）
+        codes = np.zeros(len(df), dtype=np.int8)
+        df['指数代码'] = pd.Categorical.from_codes(codes, categories=[save_code])
+        df['指数名称'] = pd.Categorical.from_codes(codes, categories=[index_name])
         
         logger.info(f"{index_name}: 下载成功，共 {len(df)} 条记录")
         
@@ -306,47 +396,57 @@ def download_index_data(download_code, index_name, save_code, start_date, end_da
         logger.error(f"{index_name}: 下载异常 - {e}")
         return None
 
+# 合并后需要重算的列（派生字段 + 周期收益率）
+COMPUTED_COLUMNS = ['涨跌额', '振幅', '波动异常'] + list(RETURN_PERIODS)
+
 def merge_data(df_existing, df_new, index_name):
     """
-    合并新旧数据（修复版）
+    合并新旧数据
     
-    ✅ 修复：确保日期列在使用.dt之前是datetime类型
+    新数据覆盖已有数据中自其起始日开始的部分，日期列保持 YYYY-MM-DD 字符串
     """
+    tail_start = None
+    
     if df_existing is None or df_existing.empty:
         df_result = df_new
     elif df_new is None or df_new.empty:
         return df_existing
     else:
-        # 确保日期格式一致
-        df_existing['日期'] = pd.to_datetime(df_existing['日期'])
-        df_new['日期'] = pd.to_datetime(df_new['日期'])
-        
-        # 合并
-        df_result = pd.concat([df_existing, df_new], ignore_index=True)
-        
-        # 去重（保留最新的）
-        df_result = df_result.drop_duplicates(subset=['日期'], keep='last')
-        
-        # 排序
-        df_result = df_result.sort_values('日期').reset_index(drop=True)
-    
-    # ✅ 修复：在使用.dt之前确保日期列是datetime类型
-    if df_result['日期'].dtype != 'datetime64[ns]':
-        df_result['日期'] = pd.to_datetime(df_result['日期'])
-    
-    # 转换日期回字符串
-    df_result['日期'] = df_result['日期'].dt.strftime('%Y-%m-%d')
-    
-    # 重新计算派生字段
-    df_result = calculate_derived_fields(df_result)
-    
-    # 重新计算周期收益率
-    df_result = calculate_period_returns(df_result)
+        # 已有数据和新数据各自按日期升序（ISO日期字符串可直接比较）：
+        # 保留已有数据中新数据起始日之前的行，直接接上新数据，无需去重和排序
+        cutoff = df_new['日期'].min()
+        head = df_existing[df_existing['日期'] < cutoff]
+        df_result = pd.concat([head, df_new], ignore_index=True)
+        
+        # 只有新数据起始日及之后的行会变化
+        tail_start = len(head)
+    
+    if (tail_start and not INCREMENTAL_CONFIG['force_full_recompute']
+            and all(col in df_existing.columns for col in COMPUTED_COLUMNS)):
+        # 增量：从变化起点往前多取最长周期的行作为上下文重算，只替换变化的尾部，头部沿用已有结果
+        context_start = max(tail_start - max(RETURN_PERIODS.values()), 0)
+        tail = calculate_derived_fields(df_result.iloc[context_start:].reset_index(drop=True), presorted=True)
+        df_result = pd.concat([df_result.iloc[:tail_start], tail.iloc[tail_start - context_start:]], ignore_index=True)
+    else:
+        # 首次下载或历史数据缺少计算列：全量重算派生字段和周期收益率（合并结果已有序，首次下载时排序）
+        df_result = calculate_derived_fields(df_result, presorted=tail_start is not None)
     
     logger.info(f"{index_name}: 合并后共 {len(df_result)} 条记录")
     
     return df_result
 
+def save_parquet(df, file_path):
+    """按 PARQUET_WRITE_OPTIONS 写入parquet：先写临时文件再原子替换，旧文件（及其硬链接备份）内容保持不变"""
+    write_parquet_atomic(df, file_path, PARQUET_WRITE_OPTIONS)
+
+def list_backups(backup_subdir, index_code):
+    """列出某指数的备份文件名，按时间从新到旧；os.scandir 一次读出目录项，不逐个创建Path"""
+    prefix = f"{index_code}_"
+    with os.scandir(backup_subdir) as entries:
+        names = [entry.name for entry in entries if entry.name.startswith(prefix) and entry.name.endswith('.parquet')]
+    # 文件名带 YYYYMMDD_HHMMSS 时间戳，按字典序即按时间排序
+    return sorted(names, reverse=True)
+
 def backup_file(file_path, index_name):
     """备份单个文件"""
     if not file_path.exists():
@@ -357,21 +457,93 @@ def backup_file(file_path, index_name):
         backup_subdir = BACKUP_DIR / index_code
         backup_subdir.mkdir(parents=True, exist_ok=True)
         
+        # 距最近一次备份不足 backup_interval_days 天时跳过
+        backups = list_backups(backup_subdir, index_code)
+        if backups:
+            last_backup_time = datetime.strptime(backups[0][len(index_code) + 1:-len('.parquet')], '%Y%m%d_%H%M%S')
+            if datetime.now() - last_backup_time < timedelta(days=INCREMENTAL_CONFIG['backup_interval_days']):
+                logger.debug(f"{index_name}: 最近备份于 {last_backup_time}，本次不备份")
+                return
+        
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         backup_file = backup_subdir / f"{index_code}_{timestamp}.parquet"
         
-        shutil.copy2(file_path, backup_file)
+        # 硬链接代替复制（只增加一个目录项，不读写文件内容）；
+        # save_parquet 总是写新文件再替换，不会改动备份指向的旧文件。跨设备等不支持时退回复制
+        try:
+            os.link(file_path, backup_file)
+        except OSError:
+            shutil.copy2(file_path, backup_file)
         logger.debug(f"已备份: {backup_file}")
         
         # 清理旧备份（保留最近3个）
-        backups = sorted(backup_subdir.glob(f"{index_code}_*.parquet"), reverse=True)
-        for old_backup in backups[3:]:
-            old_backup.unlink()
+        for old_backup in list_backups(backup_subdir, index_code)[3:]:
+            os.unlink(backup_subdir / old_backup)
             logger.debug(f"删除旧备份: {old_backup}")
     
     except Exception as e:
         logger.warning(f"{index_name} 备份失败: {e}")
 
+def process_one(index_info):
+    """
+    处理单个指数：读取现有数据 → 下载 → 合并 → 保存
+    
+    返回: (状态, 新增记录数)，状态为 'updated' / 'skipped' / 'failed'
+    """
+    index_name = index_info['name']
+    save_code = index_info['code']
+    download_code = index_info['download_code']
+    
+    # 读取现有数据的最新日期（只读footer）
+    latest_date = get_latest_date(save_code)
+    
+    # 计算下载范围
+    start_date, end_date, need_download = calculate_download_range(latest_date, index_name)
+    
+    if not need_download:
+        return 'skipped', 0
+    
+    # 确实需要下载时才读取完整的现有数据
+    df_existing = None
+    if latest_date is not None:
+        df_existing, _ = get_existing_data(save_code)
+        # footer可读但完整读取失败：不能用回溯区间的数据覆盖整个历史文件
+        if df_existing is None:
+            logger.error(f"{index_name}: 现有数据读取失败，跳过更新以免覆盖历史数据")
+            return 'failed', 0
+    
+    # 备份
+    if INCREMENTAL_CONFIG['backup_before_update'] and df_existing is not None:
+        file_path = OUTPUT_DIR / f"{save_code}.parquet"
+        backup_file(file_path, index_name)
+    
+    # 下载新数据（Baostock请求串行）
+    with BAOSTOCK_LOCK:
+        df_new = download_index_data(download_code, index_name, save_code, start_date, end_date)
+    
+    if df_new is None:
+        return 'failed', 0
+    
+    # 合并数据
+    df_final = merge_data(df_existing, df_new, index_name)
+    
+    if df_final is None or df_final.empty:
+        return 'failed', 0
+    
+    # 保存Parquet格式（每个指数一个文件，线程间无需加锁）
+    output_file = OUTPUT_DIR / f"{save_code}.parquet"
+    save_parquet(df_final, output_file)
+    
+    # 按需保存CSV版本（utf-8-sig 便于Excel打开）
+    if INCREMENTAL_CONFIG['emit_csv']:
+        csv_file = OUTPUT_DIR / f"{save_code}.csv"
+        tmp_csv_file = csv_file.with_name(csv_file.name + '.tmp')
+        df_final.to_csv(tmp_csv_file, index=False, encoding='utf-8-sig')
+        os.replace(tmp_csv_file, csv_file)
+    
+    new_records = len(df_new) if not df_new.empty else 0
+    return 'updated', new_records
+
 # ============================================================
 # 主程序
 # ============================================================
@@ -384,20 +556,12 @@ def main():
     print("  ✅ 避免重复下载")
     print("=" * 80)
     
-    # 检查今天是否是交易日
-    is_trading, days_since = is_trading_day_today()
-    today_str = datetime.now().strftime('%Y-%m-%d (%A)')
-    
-    if is_trading:
-        print(f"\n📅 今天: {today_str} - 交易日")
-    else:
-        print(f"\n📅 今天: {today_str} - 非交易日（距离上个交易日约{days_since}天）")
-    
     print(f"\n配置:")
     print(f"  强制全量下载: {'是' if INCREMENTAL_CONFIG['force_full_download'] else '否'}")
     print(f"  回溯天数: {INCREMENTAL_CONFIG['lookback_days']} 天")
     print(f"  最小更新间隔: {INCREMENTAL_CONFIG['min_gap_days']} 天")
     print(f"  智能交易日检测: {'是' if INCREMENTAL_CONFIG['smart_trading_day_check'] else '否'}")
+    print(f"  输出CSV: {'是' if INCREMENTAL_CONFIG['emit_csv'] else '否'}")
     print(f"  结束日期: {END_DATE}")
     
     print(f"\n指数列表:")
@@ -415,6 +579,17 @@ def main():
     logger.info("✅ 登录成功")
     print("✅ 登录成功")
     
+    # 检查今天是否是交易日（先加载交易日历，节假日也能识别）
+    if INCREMENTAL_CONFIG['smart_trading_day_check']:
+        load_trade_calendar()
+    is_trading, days_since = is_trading_day_today()
+    today_str = datetime.now().strftime('%Y-%m-%d (%A)')
+    
+    if is_trading:
+        print(f"\n📅 今天: {today_str} - 交易日")
+    else:
+        print(f"\n📅 今天: {today_str} - 非交易日（距离上个交易日{days_since}天）")
+    
     # 统计信息
     stats = {
         'total': len(INDICES),
@@ -427,51 +602,20 @@ def main():
     # 下载指数数据
     print(f"\n开始智能增量更新...\n")
     
-    for key, index_info in tqdm(INDICES.items(), desc="更新进度"):
-        index_name = index_info['name']
-        save_code = index_info['code']
-        download_code = index_info['download_code']
-        
-        # 读取现有数据
-        df_existing, latest_date = get_existing_data(save_code)
-        
-        # 计算下载范围
-        start_date, end_date, need_download = calculate_download_range(latest_date, index_name)
-        
-        if not need_download:
-            stats['skipped'] += 1
-            continue
-        
-        # 备份
-        if INCREMENTAL_CONFIG['backup_before_update'] and df_existing is not None:
-            file_path = OUTPUT_DIR / f"{save_code}.parquet"
-            backup_file(file_path, index_name)
-        
-        # 下载新数据
-        df_new = download_index_data(download_code, index_name, save_code, start_date, end_date)
-        
-        if df_new is None:
-            stats['failed'] += 1
-            continue
-        
-        # 合并数据
-        df_final = merge_data(df_existing, df_new, index_name)
-        
-        if df_final is None or df_final.empty:
-            stats['failed'] += 1
-            continue
-        
-        # 保存Parquet格式
-        output_file = OUTPUT_DIR / f"{save_code}.parquet"
-        df_final.to_parquet(output_file, index=False)
-        
-        # 同时保存CSV版本
-        csv_file = OUTPUT_DIR / f"{save_code}.csv"
-        df_final.to_csv(csv_file, index=False, encoding='utf-8-sig')
-        
-        new_records = len(df_new) if not df_new.empty else 0
-        stats['new_records'] += new_records
-        stats['updated'] += 1
+    # 各指数互不依赖，并发处理（Baostock请求串行）
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {executor.submit(process_one, index_info): index_info['name'] for index_info in INDICES.values()}
+        
+        for future in tqdm(as_completed(futures), total=len(futures), desc="更新进度"):
+            index_name = futures[future]
+            try:
+                status, new_records = future.result()
+            except Exception as e:
+                logger.error(f"{index_name}: 处理异常 - {e}")
+                status, new_records = 'failed', 0
+            
+            stats[status] += 1
+            stats['new_records'] += new_records
     
     # 退出登录
     bs.logout()
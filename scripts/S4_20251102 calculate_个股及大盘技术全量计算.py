@@ -35,8 +35,13 @@ from datetime import datetime
 from tqdm import tqdm
 import logging
 import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor, wait
 from functools import partial
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 import warnings
+from numba_kernels import ewm_alpha, kdj, macd, rolling_extremes, rolling_means
 warnings.filterwarnings('ignore')
 
 # ============================================================
@@ -54,6 +59,16 @@ LOG_DIR = Path("logs")
 USE_MULTIPROCESSING = True      # 是否使用多进程
 NUM_PROCESSES = mp.cpu_count()  # 进程数
 BATCH_SIZE = 100                # 批处理大小
+POOL_MAXTASKSPERCHILD = 64      # 单个工作进程处理多少任务后重建（释放累积内存）
+# fork 启动子进程无需重新导入本模块；不支持 fork 的平台（Windows）改用线程池：
+# spawn 的每个进程都要重新导入本模块、加载内核，而指标内核和 pyarrow 读写都释放GIL，线程即可并行
+POOL_BACKEND = 'fork' if 'fork' in mp.get_all_start_methods() else 'thread'
+
+# 指标周期配置
+MA_PERIODS = [5, 10, 20, 30, 50, 60, 120, 150, 200, 250]        # 均线
+RSI_PERIODS = [6, 12, 14, 24]                                   # RSI
+CHANGE_PERIODS = [1, 5, 10, 20, 25, 30, 60, 120, 180, 250]      # 涨跌幅
+VOLUME_MA_PERIODS = [5, 10, 20, 30, 60, 90]                     # 成交量均线
 
 # 小数位数配置
 DECIMAL_CONFIG = {
@@ -68,6 +83,14 @@ DECIMAL_CONFIG = {
     'rs_raw': 4,       # RS原始值：4位小数
 }
 
+# 指标文件写入参数：zstd压缩；代码、名称每个文件只有一个取值，用字典编码（文件中没有的列会被忽略）
+PARQUET_WRITE_OPTIONS = {
+    'compression': 'zstd',
+    'compression_level': 3,
+    'use_dictionary': ['股票代码', '股票名称', '指数代码', '指数名称'],
+    'row_group_size': 50000,
+}
+
 # 创建目录
 OUTPUT_STOCK_DIR.mkdir(parents=True, exist_ok=True)
 OUTPUT_INDEX_DIR.mkdir(parents=True, exist_ok=True)
@@ -175,98 +198,93 @@ def convert_to_english_for_calculation(df, is_index=False):
 # 技术指标计算函数
 # ============================================================
 
-def calculate_ma(df, periods=[5, 10, 20, 30, 50, 60, 120, 150, 200, 250]):
+def calculate_ma(close, periods=MA_PERIODS):
     """
     计算移动平均线
     
     新增：ma50, ma150, ma200（v4.0）
     保留：ma5, ma10, ma20, ma30, ma60, ma120, ma250（v3.0）
     """
-    for period in periods:
-        df[f'ma{period}'] = df['close'].rolling(window=period).mean()
-    return df
+    # 一次遍历算出所有周期的均线（滑动求和内核）
+    mas = rolling_means(close, np.asarray(periods, dtype=np.int64))
+    return {f'ma{period}': ma for period, ma in zip(periods, mas)}
 
-def calculate_rsi(df, periods=[6, 12, 14, 24]):
+def calculate_rsi(close, periods=RSI_PERIODS):
     """计算RSI（相对强弱指标）- 多周期"""
-    for period in periods:
-        delta = df['close'].diff()
-        gain = (delta.where(delta > 0, 0)).rolling(window=period).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
-        
-        rs = gain / loss
-        rsi = 100 - (100 / (1 + rs))
-        
-        df[f'rsi{period}'] = rsi
-    return df
+    # 涨跌额只算一次（首行及NaN处按0计），各周期的平均涨幅/跌幅由多周期均线内核一次算完
+    delta = np.empty_like(close)
+    delta[:1] = np.nan
+    delta[1:] = close[1:] - close[:-1]
+    gain = np.where(delta > 0, delta, 0.0)
+    loss = np.where(delta < 0, -delta, 0.0)
+    
+    windows = np.asarray(periods, dtype=np.int64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsis = 100 - (100 / (1 + rolling_means(gain, windows) / rolling_means(loss, windows)))
+    
+    return {f'rsi{period}': rsi for period, rsi in zip(periods, rsis)}
 
-def calculate_macd(df, fast=12, slow=26, signal=9):
+def calculate_macd(close, fast=12, slow=26, signal=9):
     """计算MACD"""
-    ema_fast = df['close'].ewm(span=fast, adjust=False).mean()
-    ema_slow = df['close'].ewm(span=slow, adjust=False).mean()
-    
-    macd = ema_fast - ema_slow
-    signal_line = macd.ewm(span=signal, adjust=False).mean()
-    histogram = macd - signal_line
-    
-    df['macd_dif'] = macd
-    df['macd_dea'] = signal_line
-    df['macd'] = histogram  # 也叫MACD柱
-    df['macd_bar'] = histogram
-    
-    return df
+    # 快慢线、信号线三条 ewm(adjust=False) 在一个内核里一次遍历递推完
+    dif, dea, histogram = macd(close, ewm_alpha(span=fast), ewm_alpha(span=slow), ewm_alpha(span=signal))
+    
+    return {
+        'macd_dif': dif,
+        'macd_dea': dea,
+        'macd': histogram,  # 也叫MACD柱
+        'macd_bar': histogram,
+    }
 
-def calculate_kdj(df, n=9, m1=3, m2=3):
+def calculate_kdj(high, low, close, n=9, m1=3, m2=3):
     """计算KDJ指标"""
-    low_min = df['low'].rolling(window=n).min()
-    high_max = df['high'].rolling(window=n).max()
-    
-    rsv = (df['close'] - low_min) / (high_max - low_min) * 100
+    # RSV（N日高低点）、K、D 两次 ewm(adjust=False) 和 J 由一个内核算完
+    k, d, j = kdj(high, low, close, n, ewm_alpha(alpha=1/m1), ewm_alpha(alpha=1/m2))
     
-    k = rsv.ewm(alpha=1/m1, adjust=False).mean()
-    d = k.ewm(alpha=1/m2, adjust=False).mean()
-    j = 3 * k - 2 * d
-    
-    df['kdj_k'] = k
-    df['kdj_d'] = d
-    df['kdj_j'] = j
-    
-    return df
+    return {'kdj_k': k, 'kdj_d': d, 'kdj_j': j}
 
-def calculate_price_changes(df, periods=[1, 5, 10, 20, 25, 30, 60, 120, 180, 250]):
-    """计算不同周期的涨跌幅"""
-    for period in periods:
-        df[f'change_{period}d'] = df['close'].pct_change(period) * 100
-    return df
+def calculate_period_returns(close, periods=CHANGE_PERIODS):
+    """计算不同周期的收益率（同 pct_change(period)，NaN不向前填充），返回 周期 → 数组"""
+    returns = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for period in periods:
+            change = np.full(close.shape[0], np.nan)
+            change[period:] = close[period:] / close[:-period] - 1
+            returns[period] = change
+    return returns
+
+def calculate_price_changes(returns):
+    """计算不同周期的涨跌幅（百分比）"""
+    return {f'change_{period}d': change * 100 for period, change in returns.items()}
 
-def calculate_volume_indicators(df):
+def calculate_volume_indicators(volume):
     """计算成交量指标"""
-    # 成交量移动平均
-    df['volume_ma5'] = df['volume'].rolling(window=5).mean()
-    df['volume_ma10'] = df['volume'].rolling(window=10).mean()
-    df['volume_ma20'] = df['volume'].rolling(window=20).mean()
-    df['volume_ma30'] = df['volume'].rolling(window=30).mean()
+    # 成交量移动平均（含新增的60、90日），与价格均线共用同一个多周期内核
+    volume_mas = rolling_means(volume, np.asarray(VOLUME_MA_PERIODS, dtype=np.int64))
+    columns = {f'volume_ma{period}': volume_ma for period, volume_ma in zip(VOLUME_MA_PERIODS, volume_mas)}
     
     # 量比（5日）
-    df['volume_ma60'] = df['volume'].rolling(window=60).mean()  # 新增
-    df['volume_ma90'] = df['volume'].rolling(window=90).mean()  # 新增
-    df['volume_ratio_5d'] = df['volume'] / df['volume'].rolling(window=5).mean()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        columns['volume_ratio_5d'] = volume / volume_mas[0]
     
-    return df
+    return columns
 
-def calculate_price_range(df):
+# 价格区间：列名后缀 → 交易日数（52周约252个交易日）
+PRICE_RANGE_WINDOWS = {'20d': 20, '60d': 60, '120d': 120, '250d': 250, '52w': 252}
+PRICE_RANGE_LENGTHS = np.array(list(PRICE_RANGE_WINDOWS.values()), dtype=np.int64)
+
+def calculate_price_range(high, low):
     """计算价格区间（高低点）"""
-    # 20日、60日、120日、250日高低点
-    for period in [20, 60, 120, 250]:
-        df[f'high_{period}d'] = df['high'].rolling(window=period).max()
-        df[f'low_{period}d'] = df['low'].rolling(window=period).min()
-    
-    # 52周高低点（约252个交易日）
-    df['high_52w'] = df['high'].rolling(window=252).max()
-    df['low_52w'] = df['low'].rolling(window=252).min()
-    
-    return df
+    # 20日、60日、120日、250日、52周高低点：单调队列内核一次遍历算完所有窗口
+    highs, lows = rolling_extremes(high, low, PRICE_RANGE_LENGTHS)
+    columns = {}
+    for suffix, high_max, low_min in zip(PRICE_RANGE_WINDOWS, highs, lows):
+        columns[f'high_{suffix}'] = high_max
+        columns[f'low_{suffix}'] = low_min
+    
+    return columns
 
-def calculate_rs_raw(df):
+def calculate_rs_raw(returns):
     """
     计算相对强度原始值 (RS Raw) - v4.0 新增
     
@@ -279,67 +297,80 @@ def calculate_rs_raw(df):
     - 个股和大盘都可以计算此值
     - 排名需要在所有股票计算完后统一处理
     """
-    # 计算不同周期的涨跌幅
+    # 不同周期的涨跌幅直接复用涨跌幅指标已算好的收益率
     periods = [20, 60, 120, 250]  # 1月、3月、6月、1年
     weights = [0.4, 0.3, 0.2, 0.1]  # 权重：近期权重更高
     
-    rs_values = []
-    for period in periods:
-        change = df['close'].pct_change(period)
-        rs_values.append(change)
-    
     # 加权平均
-    rs_raw = sum(w * rs for w, rs in zip(weights, rs_values))
-    df['rs_raw'] = rs_raw
+    rs_raw = sum(w * returns[period] for w, period in zip(weights, periods))
     
-    return df
+    return {'rs_raw': rs_raw}
 
-def round_indicators(df):
-    """控制指标的小数位数"""
-    # MA系列
-    ma_cols = [col for col in df.columns if col.startswith('ma') and col[2:].isdigit()]
-    for col in ma_cols:
-        df[col] = df[col].round(DECIMAL_CONFIG['ma'])
-    
-    # RSI
-    rsi_cols = [col for col in df.columns if col.startswith('rsi')]
-    for col in rsi_cols:
-        df[col] = df[col].round(DECIMAL_CONFIG['rsi'])
-    
-    # MACD系列
-    macd_cols = [col for col in df.columns if 'macd' in col.lower()]
-    for col in macd_cols:
-        df[col] = df[col].round(DECIMAL_CONFIG['macd'])
-    
-    # KDJ系列
-    kdj_cols = [col for col in df.columns if col.startswith('kdj_')]
-    for col in kdj_cols:
-        df[col] = df[col].round(DECIMAL_CONFIG['kdj'])
-    
-    # 涨跌幅系列
-    change_cols = [col for col in df.columns if col.startswith('change_')]
-    for col in change_cols:
-        df[col] = df[col].round(DECIMAL_CONFIG['change'])
-    
-    # 成交量指标
-    volume_cols = [col for col in df.columns if 'volume' in col and col != 'volume' and col != '成交量']
-    for col in volume_cols:
-        df[col] = df[col].round(DECIMAL_CONFIG['volume'])
-    
-    # 价格区间
-    price_cols = [col for col in df.columns if 'high_' in col or 'low_' in col]
-    for col in price_cols:
-        df[col] = df[col].round(DECIMAL_CONFIG['price'])
-    
-    # RS原始值（v4.0新增）
-    if 'rs_raw' in df.columns:
-        df['rs_raw'] = df['rs_raw'].round(DECIMAL_CONFIG['rs_raw'])
-    
-    # RS Rating（稍后计算）
-    if 'rs_rating' in df.columns:
-        df['rs_rating'] = df['rs_rating'].round(DECIMAL_CONFIG['rs_rating'])
+# 指标列 → 小数位数（模块加载时建好，取整时直接查表）
+INDICATOR_DECIMALS = {
+    **{f'ma{period}': DECIMAL_CONFIG['ma'] for period in MA_PERIODS},
+    **{f'rsi{period}': DECIMAL_CONFIG['rsi'] for period in RSI_PERIODS},
+    **dict.fromkeys(['macd_dif', 'macd_dea', 'macd', 'macd_bar'], DECIMAL_CONFIG['macd']),
+    **dict.fromkeys(['kdj_k', 'kdj_d', 'kdj_j'], DECIMAL_CONFIG['kdj']),
+    **{f'change_{period}d': DECIMAL_CONFIG['change'] for period in CHANGE_PERIODS},
+    **{f'volume_ma{period}': DECIMAL_CONFIG['volume'] for period in VOLUME_MA_PERIODS},
+    'volume_ratio_5d': DECIMAL_CONFIG['volume'],
+    **{f'{side}_{suffix}': DECIMAL_CONFIG['price'] for suffix in PRICE_RANGE_WINDOWS for side in ('high', 'low')},
+    'rs_raw': DECIMAL_CONFIG['rs_raw'],
+    'rs_rating': DECIMAL_CONFIG['rs_rating'],
+}
+
+def round_indicators(columns, block):
+    """控制指标的小数位数：指标矩阵按小数位数分组，每组的行只调用一次 np.round"""
+    groups = {}
+    for row, col in enumerate(columns):
+        decimals = INDICATOR_DECIMALS.get(col)
+        if decimals is not None:
+            groups.setdefault(decimals, []).append(row)
+    for decimals, rows in groups.items():
+        block[rows] = np.round(block[rows], decimals)
+    return block
+
+def compute_indicators(close, high, low, volume):
+    """
+    在numpy数组上计算所有技术指标
     
-    return df
+    返回 (列名列表, 指标矩阵)：矩阵每行一个指标，已控制小数位数
+    """
+    returns = calculate_period_returns(close)
+    indicators = {}
+    indicators.update(calculate_ma(close))              # 包含新增的ma50, ma150, ma200
+    indicators.update(calculate_rsi(close))
+    indicators.update(calculate_macd(close))
+    indicators.update(calculate_kdj(high, low, close))
+    indicators.update(calculate_price_changes(returns))
+    indicators.update(calculate_volume_indicators(volume))
+    indicators.update(calculate_price_range(high, low))
+    indicators.update(calculate_rs_raw(returns))        # v4.0 新增：RS原始值
+    
+    # 所有指标放进一个矩阵，统一取整，之后直接作为DataFrame的一个数据块
+    columns = list(indicators)
+    block = np.stack(list(indicators.values()))
+    return columns, round_indicators(columns, block)
+
+def warm_up_kernels():
+    """
+    在主进程中先跑一遍指标计算，触发 numba 内核编译（或从缓存加载）
+    
+    fork 出的工作进程直接继承已编译的内核，不必每个进程各自编译/加载一遍；
+    线程池的各线程也不会在第一个文件上同时等待编译
+    """
+    # 走与真实文件相同的 DataFrame → numpy 转换路径，内核按相同的数组类型（含只读视图）编译
+    close = np.linspace(10.0, 20.0, 300)
+    sample = pd.DataFrame({
+        '日期': pd.date_range('2020-01-01', periods=len(close)).strftime('%Y-%m-%d'),
+        '开盘': close,
+        '最高': close + 1.0,
+        '最低': close - 1.0,
+        '收盘': close,
+        '成交量': close * 1000.0,
+    })
+    calculate_all_indicators(sample)
 
 def calculate_all_indicators(df, is_index=False):
     """
@@ -358,18 +389,20 @@ def calculate_all_indicators(df, is_index=False):
     # 确保数据按日期排序
     df = df.sort_values('date').reset_index(drop=True)
     
+    # 输入列只取一次numpy数组，各类指标都在数组上计算，返回 列名 → 数组
+    close = df['close'].to_numpy(dtype=np.float64)
+    high = df['high'].to_numpy(dtype=np.float64)
+    low = df['low'].to_numpy(dtype=np.float64)
+    volume = df['volume'].to_numpy(dtype=np.float64, na_value=np.nan)
+    
     # 计算各类指标
-    df = calculate_ma(df)              # 包含新增的ma50, ma150, ma200
-    df = calculate_rsi(df)
-    df = calculate_macd(df)
-    df = calculate_kdj(df)
-    df = calculate_price_changes(df)
-    df = calculate_volume_indicators(df)
-    df = calculate_price_range(df)
-    df = calculate_rs_raw(df)          # v4.0 新增：RS原始值
-    
-    # 控制小数位数
-    df = round_indicators(df)
+    columns, block = compute_indicators(close, high, low, volume)
+    
+    # 所有指标列一次拼接到原数据后（逐列插入会反复重建列索引）；矩阵转置即DataFrame的数据块，不再复制
+    df = pd.concat(
+        [df.drop(columns=columns, errors='ignore'), pd.DataFrame(block.T, index=df.index, columns=columns, copy=False)],
+        axis=1,
+    )
     
     # 转换回中文列名
     if is_index:
@@ -409,7 +442,7 @@ def calculate_all_indicators(df, is_index=False):
 # 单个文件处理
 # ============================================================
 
-def process_single_file(file_path, is_index=False, output_dir=None):
+def process_single_file(file_path, is_index=False, output_dir=None, writer=None, previous_write=None):
     """
     处理单个文件（个股或指数）
     
@@ -417,10 +450,12 @@ def process_single_file(file_path, is_index=False, output_dir=None):
     - file_path: 输入文件路径
     - is_index: 是否为指数数据
     - output_dir: 输出目录
+    - writer: 写入线程池；传入时保存交给写入线程，结果中的 pending_write 为写入任务
+    - previous_write: 上一个文件的写入任务；本文件算完、提交写入前才等待它
     """
     try:
-        # 读取数据
-        df = pd.read_parquet(file_path)
+        # 读取数据（原始列全部保留输出，逐列转换，不再合并成大块）
+        df = pq.read_table(file_path).to_pandas(split_blocks=True, self_destruct=True)
         
         # 标准化列名
         df = normalize_columns(df, is_index=is_index)
@@ -430,13 +465,20 @@ def process_single_file(file_path, is_index=False, output_dir=None):
         
         # 保存结果
         output_file = output_dir / file_path.name
-        df.to_parquet(output_file, index=False)
-        
-        return {
+        result = {
             'file': file_path.name,
             'rows': len(df),
             'success': True
         }
+        if writer is None:
+            df.to_parquet(output_file, index=False, **PARQUET_WRITE_OPTIONS)
+        else:
+            # 提交前先等上一个文件写完，最多一个文件排队，算得比写得快时不会积压占用内存
+            if previous_write is not None:
+                wait([previous_write])
+            result['pending_write'] = writer.submit(df.to_parquet, output_file, index=False, **PARQUET_WRITE_OPTIONS)
+        
+        return result
     
     except Exception as e:
         logger.error(f"{file_path.name}: 处理失败 - {e}")
@@ -461,19 +503,48 @@ def process_batch(files, is_index=False, output_dir=None, desc="处理进度"):
     if USE_MULTIPROCESSING and NUM_PROCESSES > 1 and not is_index:
         # 多进程处理（仅用于个股，指数文件少不需要）
         process_func = partial(process_single_file, is_index=is_index, output_dir=output_dir)
+        warm_up_kernels()
         
-        with mp.Pool(processes=NUM_PROCESSES) as pool:
-            results = list(tqdm(
-                pool.imap(process_func, files),
-                total=len(files),
-                desc=desc
-            ))
+        if POOL_BACKEND == 'thread':
+            with ThreadPoolExecutor(max_workers=NUM_PROCESSES) as executor:
+                results = list(tqdm(
+                    executor.map(process_func, files),
+                    total=len(files),
+                    desc=desc
+                ))
+        else:
+            # 每个进程约分到4批任务，减少进程间通信；结果只用于统计，无序返回即可
+            chunksize = max(1, len(files) // (NUM_PROCESSES * 4))
+            ctx = mp.get_context(POOL_BACKEND)
+            
+            with ctx.Pool(processes=NUM_PROCESSES, maxtasksperchild=POOL_MAXTASKSPERCHILD) as pool:
+                results = list(tqdm(
+                    pool.imap_unordered(process_func, files, chunksize=chunksize),
+                    total=len(files),
+                    desc=desc
+                ))
     else:
-        # 单进程处理
+        # 单进程处理：写盘交给一个写入线程（parquet压缩写盘释放GIL），与下一个文件的读取、计算重叠
         results = []
-        for file_path in tqdm(files, desc=desc):
-            result = process_single_file(file_path, is_index=is_index, output_dir=output_dir)
-            results.append(result)
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            previous_write = None
+            for file_path in tqdm(files, desc=desc):
+                # 上一个文件在写入线程中写盘的同时，读取并计算当前文件
+                result = process_single_file(file_path, is_index=is_index, output_dir=output_dir,
+                                             writer=writer, previous_write=previous_write)
+                previous_write = result.get('pending_write', previous_write)
+                results.append(result)
+        
+        # 写盘失败的文件计为失败
+        for result in results:
+            pending_write = result.pop('pending_write', None)
+            if pending_write is None:
+                continue
+            try:
+                pending_write.result()
+            except Exception as e:
+                logger.error(f"{result['file']}: 保存失败 - {e}")
+                result.update(success=False, error=str(e))
     
     # 统计结果
     stats['success'] = sum(1 for r in results if r and r.get('success', False))
@@ -485,6 +556,49 @@ def process_batch(files, is_index=False, output_dir=None, desc="处理进度"):
 # RS Rating 排名计算（v4.0 新增）
 # ============================================================
 
+def pct_rank_min(groups, values):
+    """
+    组内百分位排名，等价于 groupby(groups).rank(pct=True, method='min') * 100
+    
+    先按值排序，再按组号稳定排序（组号转为最小整型，numpy 走基数排序），
+    之后每组、每段相同值都是连续的，段首位置减组首位置即最小排名。values 不含NaN。
+    
+    groups 直接传 Series：字符串列在 pandas 内部分组编码，不必先转成 Python 字符串对象数组
+    """
+    codes = pd.factorize(groups)[0]
+    if len(codes) == 0:
+        return np.empty(0)
+    codes = codes.astype(np.min_scalar_type(codes.max()))
+    order = np.argsort(values)
+    order = order[np.argsort(codes[order], kind='stable')]
+    sorted_codes = codes[order]
+    sorted_values = values[order]
+    
+    n = len(order)
+    idx = np.arange(n)
+    new_group = np.ones(n, dtype=bool)
+    new_group[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    new_value = new_group.copy()
+    new_value[1:] |= sorted_values[1:] != sorted_values[:-1]
+    
+    group_start = np.maximum.accumulate(np.where(new_group, idx, 0))
+    value_start = np.maximum.accumulate(np.where(new_value, idx, 0))
+    group_size = np.bincount(codes)[sorted_codes]
+    
+    out = np.empty(n)
+    out[order] = (value_start - group_start + 1) / group_size * 100
+    return out
+
+def align_by_date(file_dates, dates, values):
+    """按日期把 values 对齐到 file_dates（dates 须已升序），缺失日期为NaN"""
+    out = np.full(len(file_dates), np.nan)
+    if len(dates) == 0:
+        return out
+    pos = np.minimum(np.searchsorted(dates, file_dates), len(dates) - 1)
+    hit = dates[pos] == file_dates
+    out[hit] = values[pos[hit]]
+    return out
+
 def calculate_rs_rating_for_stocks():
     """
     计算个股的 RS Rating 排名（百分位）
@@ -519,29 +633,38 @@ def calculate_rs_rating_for_stocks():
     # 1. 读取所有文件的 rs_raw 数据
     print(f"\n📖 读取数据...")
     
-    all_data = []
+    read_columns = ['股票代码', '日期', 'rs_raw']
     failed_reads = 0
     
-    for file in tqdm(indicator_files, desc="读取进度"):
-        try:
-            # 只读取必要的列
-            df = pd.read_parquet(file, columns=['股票代码', '日期', 'rs_raw'])
-            all_data.append(df)
-        except Exception as e:
-            logger.error(f"{file.name}: 读取失败 - {e}")
-            failed_reads += 1
-    
-    if not all_data:
-        print("❌ 没有成功读取任何数据")
-        return {'success': 0, 'failed': failed_reads, 'total': len(indicator_files)}
+    try:
+        # 作为一个数据集一次扫描，只解码需要的三列；股票代码直接按字典读成分类列，不逐行生成字符串
+        file_format = ds.ParquetFileFormat(read_options=ds.ParquetReadOptions(dictionary_columns=['股票代码']))
+        dataset = ds.dataset([str(file) for file in indicator_files], format=file_format)
+        combined = dataset.to_table(columns=read_columns).to_pandas()
+    except Exception as e:
+        # 个别文件损坏或schema不一致时整体读取会失败，退回逐个读取并跳过坏文件
+        logger.warning(f"数据集读取失败，改为逐个文件读取 - {e}")
+        all_data = []
+        for file in tqdm(indicator_files, desc="读取进度"):
+            try:
+                all_data.append(pd.read_parquet(file, columns=read_columns))
+            except Exception as e:
+                logger.error(f"{file.name}: 读取失败 - {e}")
+                failed_reads += 1
+        
+        if not all_data:
+            print("❌ 没有成功读取任何数据")
+            return {'success': 0, 'failed': failed_reads, 'total': len(indicator_files)}
+        
+        combined = pd.concat(all_data, ignore_index=True)
+        combined['股票代码'] = combined['股票代码'].astype('category')
     
-    print(f"✅ 成功读取 {len(all_data)} 个文件")
+    print(f"✅ 成功读取 {len(indicator_files) - failed_reads} 个文件")
     if failed_reads > 0:
         print(f"⚠️  读取失败 {failed_reads} 个文件")
     
     # 2. 合并所有股票数据
     print(f"\n🔗 合并数据...")
-    combined = pd.concat(all_data, ignore_index=True)
     
     print(f"  总记录数: {len(combined):,}")
     print(f"  股票数量: {combined['股票代码'].nunique():,}")
@@ -562,9 +685,9 @@ def calculate_rs_rating_for_stocks():
     # 4. 按日期分组计算百分位排名
     print(f"\n📊 计算横向排名...")
     
-    # 使用 rank(pct=True) 计算百分位，乘以100得到0-100分
-    # method='min'：相同值取最小排名，更保守
-    combined['rs_rating'] = combined.groupby('日期')['rs_raw'].rank(pct=True, method='min') * 100
+    # 按日期计算百分位，乘以100得到0-100分
+    # 相同值取最小排名（method='min'），更保守
+    combined['rs_rating'] = pct_rank_min(combined['日期'], combined['rs_raw'].to_numpy(dtype=np.float64))
     
     # 控制小数位数（1位小数）
     combined['rs_rating'] = combined['rs_rating'].round(DECIMAL_CONFIG['rs_rating'])
@@ -583,42 +706,56 @@ def calculate_rs_rating_for_stocks():
     # 5. 更新回各股票文件
     print(f"\n💾 更新文件...")
     
-    grouped = combined.groupby('股票代码')
+    # 按(股票代码, 日期)排序后每只股票是连续的一段，直接按行号切片
+    combined = combined.sort_values(['股票代码', '日期'], ignore_index=True)
+    symbol_rows = combined.groupby('股票代码', observed=True).indices
+    rs_dates = combined['日期'].to_numpy()
+    rs_values = combined['rs_rating'].to_numpy(dtype=np.float64)
     
     success = 0
     failed = 0
     
-    for symbol, group in tqdm(grouped, desc="更新进度"):
-        try:
-            file_path = OUTPUT_STOCK_DIR / f"{symbol}.parquet"
-            
-            if not file_path.exists():
-                logger.warning(f"{symbol}: 文件不存在，跳过")
+    # 写盘交给一个写入线程，与下一个文件的读取、对齐重叠
+    pending_writes = {}
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        for symbol, rows in tqdm(symbol_rows.items(), desc="更新进度"):
+            try:
+                file_path = OUTPUT_STOCK_DIR / f"{symbol}.parquet"
+                
+                if not file_path.exists():
+                    logger.warning(f"{symbol}: 文件不存在，跳过")
+                    failed += 1
+                    continue
+                
+                # 以Arrow表读取原文件，其余列原样写回，不经过pandas转换
+                table = pq.read_table(file_path)
+                
+                # 删除旧的 rs_rating（如果有）
+                if 'rs_rating' in table.column_names:
+                    table = table.remove_column(table.schema.get_field_index('rs_rating'))
+                
+                # 按日期对齐新的 rs_rating
+                start, stop = rows[0], rows[-1] + 1
+                rs_rating = align_by_date(
+                    table.column('日期').to_numpy(),
+                    rs_dates[start:stop],
+                    rs_values[start:stop]
+                )
+                
+                # 追加为最后一列并保存；提交前先等上一个文件写完，最多一个文件排队
+                table = table.append_column('rs_rating', pa.array(rs_rating, from_pandas=True))
+                if pending_writes:
+                    wait([next(reversed(pending_writes))])
+                pending_writes[writer.submit(pq.write_table, table, file_path, **PARQUET_WRITE_OPTIONS)] = symbol
+                
+            except Exception as e:
+                logger.error(f"{symbol}: 更新失败 - {e}")
                 failed += 1
-                continue
-            
-            # 读取原文件
-            df_original = pd.read_parquet(file_path)
-            
-            # 删除旧的 rs_rating（如果有）
-            if 'rs_rating' in df_original.columns:
-                df_original = df_original.drop(columns=['rs_rating'])
-            
-            # 合并新的 rs_rating
-            df_updated = df_original.merge(
-                group[['日期', 'rs_rating']], 
-                on='日期', 
-                how='left'
-            )
-            
-            # 确保列顺序（rs_rating放在最后）
-            cols = [col for col in df_updated.columns if col != 'rs_rating'] + ['rs_rating']
-            df_updated = df_updated[cols]
-            
-            # 保存
-            df_updated.to_parquet(file_path, index=False)
+    
+    for pending_write, symbol in pending_writes.items():
+        try:
+            pending_write.result()
             success += 1
-            
         except Exception as e:
             logger.error(f"{symbol}: 更新失败 - {e}")
             failed += 1
@@ -689,6 +826,7 @@ def calculate_rs_rating_for_indexes():
     # 2. 合并所有指数数据
     print(f"\n🔗 合并数据...")
     combined = pd.concat(all_data, ignore_index=True)
+    combined['代码'] = combined['代码'].astype('category')
     
     print(f"  总记录数: {len(combined):,}")
     print(f"  指数数量: {combined['代码'].nunique():,}")
@@ -709,7 +847,7 @@ def calculate_rs_rating_for_indexes():
     # 4. 按日期分组计算百分位排名
     print(f"\n📊 计算横向排名...")
     
-    combined['rs_rating'] = combined.groupby('日期')['rs_raw'].rank(pct=True, method='min') * 100
+    combined['rs_rating'] = pct_rank_min(combined['日期'], combined['rs_raw'].to_numpy(dtype=np.float64))
     combined['rs_rating'] = combined['rs_rating'].round(DECIMAL_CONFIG['rs_rating'])
     
     unique_dates = combined['日期'].nunique()
@@ -726,7 +864,7 @@ def calculate_rs_rating_for_indexes():
     # 5. 更新回各指数文件
     print(f"\n💾 更新文件...")
     
-    grouped = combined.groupby('代码')
+    grouped = combined.groupby('代码', observed=True)
     
     success = 0
     failed = 0
@@ -758,8 +896,8 @@ def calculate_rs_rating_for_indexes():
             cols = [col for col in df_updated.columns if col != 'rs_rating'] + ['rs_rating']
             df_updated = df_updated[cols]
             
-            # 保存
-            df_updated.to_parquet(file_path, index=False)
+            # 保存（与指标计算时写入参数一致）
+            df_updated.to_parquet(file_path, index=False, **PARQUET_WRITE_OPTIONS)
             success += 1
             
         except Exception as e:
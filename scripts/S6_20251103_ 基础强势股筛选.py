@@ -43,8 +43,11 @@ CANSLIM选股策略筛选程序 - v2.0（快照版）
 基准指数：沪深300 (000300)
 """
 
+import io
 import pandas as pd
 import numpy as np
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from pathlib import Path
 from datetime import datetime, timedelta
 from tqdm import tqdm
@@ -60,6 +63,7 @@ warnings.filterwarnings('ignore')
 # 目录配置
 SNAPSHOT_DIR = Path("data/daily_snapshot")              # ⭐ 使用快照（新）
 FINANCIAL_FILE = Path("data/financial_reports.csv")    # 财务数据
+FINANCIAL_CACHE_FILE = Path("data/financial_reports.parquet")  # 财务数据的parquet缓存（CSV更新后自动重建）
 INDEX_DIR = Path("data/index_indicators")               # 大盘技术指标
 OUTPUT_DIR = Path("data/canslim_screening")
 LOG_DIR = Path("logs")
@@ -68,6 +72,19 @@ LOG_DIR = Path("logs")
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 LOG_DIR.mkdir(parents=True, exist_ok=True)
 
+# 财务数据CSV可能的编码（按顺序尝试）
+FINANCIAL_ENCODINGS = ['utf-8', 'gbk', 'gb2312', 'utf-8-sig']
+
+# 快照中筛选和导出用到的列（只读取这些列，其余指标列不解压）
+SNAPSHOT_COLUMNS = (
+    '日期', '股票代码', '股票名称', '收盘', '成交量', '成交额',
+    '涨跌幅', 'changePercent', 'change_percent',
+    'ma10', 'ma20', 'ma50', 'ma150', 'ma200',
+    'high_52w', 'low_52w', 'rs_rating',
+    'volume_ma10', 'volume_ma30', 'volume_ma60', 'volume_ma90',
+    'change_20d', 'change_60d', 'change_180d',
+)
+
 # 基准指数配置
 BENCHMARK_INDEX = '000300'  # 沪深300指数
 BENCHMARK_NAME = '沪深300'
@@ -107,6 +124,34 @@ logger = logging.getLogger(__name__)
 # 数据加载（优化版 - 使用快照）
 # ============================================================
 
+def detect_encoding(raw):
+    """返回第一个能完整解码的编码，都不能解码时返回None"""
+    for encoding in FINANCIAL_ENCODINGS:
+        try:
+            raw.decode(encoding)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return None
+
+
+def read_financial_csv():
+    """读取财务数据CSV：文件只读一次，在内存中检测编码后只解析一次，并写入parquet缓存"""
+    raw = FINANCIAL_FILE.read_bytes()
+    encoding = detect_encoding(raw)
+    if encoding is None:
+        return None
+    
+    df = pd.read_csv(io.BytesIO(raw), encoding=encoding)
+    logger.info(f"✓ 成功加载财务数据 ({encoding}): {len(df)} 条")
+    
+    try:
+        df.to_parquet(FINANCIAL_CACHE_FILE, index=False)
+    except Exception as e:
+        logger.warning(f"财务数据缓存写入失败: {e}")
+    return df
+
+
 def load_financial_data():
     """加载财务数据"""
     try:
@@ -114,16 +159,20 @@ def load_financial_data():
             logger.warning(f"财务数据文件不存在: {FINANCIAL_FILE}")
             return None
         
-        # 尝试不同编码
-        for encoding in ['utf-8', 'gbk', 'gb2312', 'utf-8-sig']:
+        # 缓存比CSV新时直接读缓存，省去CSV解析
+        df = None
+        if FINANCIAL_CACHE_FILE.exists() and FINANCIAL_CACHE_FILE.stat().st_mtime_ns >= FINANCIAL_FILE.stat().st_mtime_ns:
             try:
-                df = pd.read_csv(FINANCIAL_FILE, encoding=encoding)
-                logger.info(f"✓ 成功加载财务数据 ({encoding}): {len(df)} 条")
-                break
-            except:
-                continue
-        else:
-            return None
+                df = pd.read_parquet(FINANCIAL_CACHE_FILE)
+                logger.info(f"✓ 成功加载财务数据 (缓存): {len(df)} 条")
+            except Exception as e:
+                logger.warning(f"财务数据缓存读取失败，重新读取CSV - {e}")
+                df = None
+        
+        if df is None:
+            df = read_financial_csv()
+            if df is None:
+                return None
         
         # 标准化列名
         if '股票代码' in df.columns:
@@ -164,9 +213,15 @@ def load_snapshot_data(target_date, df_financial=None):
             logger.info(f"💡 请先运行 generate_daily_snapshot.py 生成快照")
             return None
         
-        # ⚡ 核心：一次性读取全市场快照（毫秒级）
+        # ⚡ 核心：一次性读取全市场快照（毫秒级），只读取筛选用到的列
         logger.info(f"从快照加载数据: {snapshot_file.name}")
-        df = pd.read_parquet(snapshot_file)
+        columns = [col for col in pq.read_schema(snapshot_file).names if col in SNAPSHOT_COLUMNS]
+        table = pq.read_table(snapshot_file, columns=columns)
+        
+        # 按RS评分降序（在Arrow表上排序；稳定排序，已排好序的快照顺序不变）
+        if 'rs_rating' in table.column_names:
+            table = table.take(pc.sort_indices(table, sort_keys=[('rs_rating', 'descending')]))
+        df = table.to_pandas()
         
         logger.info(f"✓ 加载快照完成: {len(df)} 只股票（用时<1秒）⚡")
         
@@ -290,15 +345,16 @@ def find_latest_available_date(target_date, max_days_back=10):
     latest_file = SNAPSHOT_DIR / "latest.parquet"
     if latest_file.exists():
         try:
-            df = pd.read_parquet(latest_file)
+            # 获取快照日期（只读取日期列）
+            names = pq.read_schema(latest_file).names
+            date_col = None
+            for col in ['日期', 'date', '交易日期']:
+                if col in names:
+                    date_col = col
+                    break
+            
+            df = pd.read_parquet(latest_file, columns=[date_col] if date_col else [])
             if not df.empty:
-                # 获取快照日期
-                date_col = None
-                for col in ['日期', 'date', '交易日期']:
-                    if col in df.columns:
-                        date_col = col
-                        break
-                
                 if date_col:
                     snapshot_date = df[date_col].iloc[0]
                     if isinstance(snapshot_date, str):
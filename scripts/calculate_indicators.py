@@ -1,15 +1,51 @@
 # scripts/calculate_indicators.py (完整Python实现版)
 import os
+import io
 import sys
-from supabase import create_client, Client
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import httpx
+from supabase import create_client, Client, ClientOptions
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import pandas as pd
 import numpy as np
 
+# 尝试导入 psycopg2（可选：配置 SUPABASE_DB_URL 后直连Postgres用COPY批量写入）
+try:
+    import psycopg2
+    HAS_PSYCOPG2 = True
+except ImportError:
+    HAS_PSYCOPG2 = False
+
+from numba_kernels import grouped_last_means, grouped_last_max, grouped_last_min
+
 load_dotenv()
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+SUPABASE_DB_URL = os.environ.get("SUPABASE_DB_URL")  # postgresql://...:5432/postgres
+FETCH_MAX_WORKERS = 8  # 并发拉取分页的线程数
+PAGE_SIZE = 1000  # PostgREST 单次请求最多返回1000行
+SYMBOL_CHUNK_SIZE = 200  # 每个in_过滤的股票数（控制请求URL长度）
+UPSERT_BATCH_SIZE = 500  # 每次upsert的记录数
+UPSERT_MAX_WORKERS = 8  # 并发upsert的线程数
+UPSERT_MAX_RETRIES = 3
+UPSERT_RETRY_DELAY = 1  # 秒，每次重试翻倍
+HTTP_TIMEOUT = 60  # 秒
+PRICE_COLUMNS = ['close', 'high', 'low']  # 以float32存放，减半内存带宽
+METRIC_DECIMALS = 4  # 价格类指标写库保留的小数位（去掉float32带来的尾数噪声）
+
+def create_supabase_client() -> Client:
+    """创建Supabase客户端：分页拉取与upsert共用同一个带连接池的HTTP/2 httpx.Client，复用TCP/TLS连接"""
+    http_client = httpx.Client(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=FETCH_MAX_WORKERS + UPSERT_MAX_WORKERS,
+            max_keepalive_connections=max(FETCH_MAX_WORKERS, UPSERT_MAX_WORKERS),
+        ),
+        timeout=HTTP_TIMEOUT,
+    )
+    return create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(httpx_client=http_client))
 
 def get_latest_trading_date(supabase: Client) -> str:
     """获取最新交易日"""
@@ -18,135 +54,231 @@ def get_latest_trading_date(supabase: Client) -> str:
         return response.data[0]['date']
     return (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
 
+def fetch_all_pages(queries: list, columns: str, order_columns: list) -> list:
+    """
+    并发拉取一组查询的全部分页
+    
+    queries 中每个元素是 query(columns, count=None) 形式的查询构造函数：
+    先并发发count请求拿到各查询的总行数，从而预先算出所有分页区间，再把所有分页一起并发拉取
+    """
+    def count_rows(query) -> int:
+        return query('symbol', count='exact').limit(1).execute().count or 0
+    
+    def fetch_page(task) -> list:
+        query, offset = task
+        request = query(columns)
+        for col in order_columns:
+            request = request.order(col)
+        response = request.range(offset, offset + PAGE_SIZE - 1).execute()
+        return response.data or []
+    
+    with ThreadPoolExecutor(max_workers=FETCH_MAX_WORKERS) as executor:
+        totals = list(executor.map(count_rows, queries))
+        tasks = [(query, offset) for query, total in zip(queries, totals) for offset in range(0, total, PAGE_SIZE)]
+        pages = list(executor.map(fetch_page, tasks))
+    
+    return [row for page in pages for row in page]
+
+def fetch_active_symbols(supabase: Client, target_date: str) -> list:
+    """获取目标交易日有K线的股票（当天无数据的股票不需要计算指标）"""
+    def query(columns: str, count=None):
+        return supabase.table('daily_bars').select(columns, count=count).eq('date', target_date)
+    
+    return [row['symbol'] for row in fetch_all_pages([query], 'symbol', ['symbol'])]
+
 def fetch_historical_bars(supabase: Client, days_back: int, target_date: str):
-    """获取历史K线数据"""
+    """获取目标交易日活跃股票的历史K线数据（按股票分块，并发拉取所有分页）"""
     start_date = (datetime.strptime(target_date, '%Y-%m-%d') - timedelta(days=days_back * 2)).strftime('%Y-%m-%d')
     
+    # 1. 先取当天有数据的股票，只拉这些股票的历史
+    active_symbols = fetch_active_symbols(supabase, target_date)
+    print(f"  -> {len(active_symbols)} active stocks on {target_date}")
+    
+    if not active_symbols:
+        print("  -> Fetched 0 records")
+        return pd.DataFrame()
+    
     print(f"  -> Fetching bars from {start_date} to {target_date}...")
-    all_data = []
-    offset = 0
-    batch_size = 1000
-    
-    while True:
-        response = supabase.table('daily_bars')\
-            .select('symbol, date, close, volume, high, low')\
-            .gte('date', start_date)\
-            .lte('date', target_date)\
-            .order('symbol')\
-            .order('date')\
-            .range(offset, offset + batch_size - 1)\
-            .execute()
-        
-        if not response.data:
-            break
-        
-        all_data.extend(response.data)
-        offset += batch_size
-        
-        if len(response.data) < batch_size:
-            break
     
-    print(f"  -> Fetched {len(all_data)} records")
-    return pd.DataFrame(all_data)
+    # 2. 按股票分块过滤（控制URL长度），每块一个查询
+    def chunk_query(symbols: list):
+        def query(columns: str, count=None):
+            return supabase.table('daily_bars')\
+                .select(columns, count=count)\
+                .in_('symbol', symbols)\
+                .gte('date', start_date)\
+                .lte('date', target_date)
+        return query
+    
+    queries = [chunk_query(active_symbols[i:i + SYMBOL_CHUNK_SIZE])
+               for i in range(0, len(active_symbols), SYMBOL_CHUNK_SIZE)]
+    all_data = fetch_all_pages(queries, 'symbol, date, close, volume, high, low', ['symbol', 'date'])
+    print(f"  -> Fetched {len(all_data)} records for {len(queries)} symbol chunks")
+    df = pd.DataFrame(all_data)
+    
+    # 价格降为float32（指标精度足够）；成交量可能含空值且数值较大，保持float64；symbol转为category
+    for col in PRICE_COLUMNS:
+        df[col] = pd.to_numeric(df[col], errors='coerce').astype('float32')
+    df['volume'] = pd.to_numeric(df['volume'], errors='coerce').astype('float64')
+    df['symbol'] = df['symbol'].astype('category')
+    return df
 
-def calculate_moving_averages(df: pd.DataFrame, periods: list) -> pd.DataFrame:
+def build_symbol_arrays(df: pd.DataFrame):
+    """
+    把已按(symbol, date)排序的K线一次性转换为按列存放的numpy数组（SoA）
+    
+    返回：(symbols, offsets, arrays)
+    - symbols: 每只股票的代码
+    - offsets: 第g只股票的行区间为 offsets[g]:offsets[g+1]
+    - arrays: date/close/high/low/volume 列数组
+    """
+    codes, symbols = pd.factorize(df['symbol'], sort=False)
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(codes)))).astype(np.int64)
+    arrays = {col: df[col].to_numpy() for col in PRICE_COLUMNS + ['volume']}
+    arrays['date'] = df['date'].to_numpy()
+    return symbols, offsets, arrays
+
+# 只有最新交易日的指标会写库，以下指标都只计算每只股票最后一根K线的值（逐股票数组）
+
+def calculate_moving_averages(close: np.ndarray, offsets: np.ndarray, periods: list) -> dict:
     """计算移动平均线"""
     print("  -> Calculating moving averages...")
     
-    # 按股票分组，计算每个周期的MA
-    for period in periods:
-        df[f'ma{period}'] = df.groupby('symbol')['close'].transform(
-            lambda x: x.rolling(window=period, min_periods=period).mean()
-        )
-    
-    return df
+    # 按股票分段，使用Numba内核从最后一根K线往前一次累加算出所有周期的MA
+    means = grouped_last_means(close, offsets, np.asarray(periods, dtype=np.int64))
+    return {f'ma{period}': means[i] for i, period in enumerate(periods)}
 
-def calculate_52w_high_low(df: pd.DataFrame, window: int = 200) -> pd.DataFrame:
+def calculate_52w_high_low(high: np.ndarray, low: np.ndarray, offsets: np.ndarray, window: int = 200) -> dict:
     """计算52周（200个交易日）高低点"""
     print("  -> Calculating 52-week high/low...")
     
-    df['high_52w'] = df.groupby('symbol')['high'].transform(
-        lambda x: x.rolling(window=window, min_periods=window).max()
-    )
-    df['low_52w'] = df.groupby('symbol')['low'].transform(
-        lambda x: x.rolling(window=window, min_periods=window).min()
-    )
-    
-    return df
+    return {
+        'high_52w': grouped_last_max(high, offsets, window),
+        'low_52w': grouped_last_min(low, offsets, window),
+    }
 
-def calculate_volume_ma(df: pd.DataFrame, periods: list) -> pd.DataFrame:
+def calculate_volume_ma(volume: np.ndarray, offsets: np.ndarray, periods: list) -> dict:
     """计算成交量均线"""
     print("  -> Calculating volume moving averages...")
     
-    for period in periods:
-        df[f'volume_ma{period}'] = df.groupby('symbol')['volume'].transform(
-            lambda x: x.rolling(window=period, min_periods=period).mean()
-        )
+    means = grouped_last_means(volume, offsets, np.asarray(periods, dtype=np.int64))
+    return {f'volume_ma{period}': means[i] for i, period in enumerate(periods)}
+
+def calculate_price_return(close: np.ndarray, offsets: np.ndarray, lookback_period: int) -> np.ndarray:
+    """每只股票过去N天的涨跌幅（%），历史不足N天或N天前价格无效时为NaN"""
+    starts, ends = offsets[:-1], offsets[1:]
+    has_history = ends - starts >= lookback_period
+    latest_close = close[ends - 1]
+    # 倒数第lookback_period行即N天前的价格
+    old_close = np.where(has_history, close[np.maximum(ends - lookback_period, starts)], np.nan)
+    old_close = np.where(old_close > 0, old_close, np.nan)
+    return (latest_close - old_close) / old_close * 100
+
+def select_latest_rows(symbols: np.ndarray, offsets: np.ndarray, dates: np.ndarray, columns: dict) -> pd.DataFrame:
+    """
+    只保留最新交易日有数据的股票，把逐股票的指标数组组装成DataFrame供写库使用
+    """
+    last_rows = offsets[1:] - 1
+    latest_date = dates.max()
+    mask = dates[last_rows] == latest_date
     
-    return df
+    latest_data = pd.DataFrame({'symbol': symbols[mask], 'date': dates[last_rows[mask]]})
+    for col, values in columns.items():
+        latest_data[col] = values[mask]
+    return latest_data
 
-def calculate_rs_rating_python(df: pd.DataFrame, lookback_period: int = 60) -> pd.DataFrame:
+def calculate_rs_rating_python(latest_data: pd.DataFrame) -> pd.DataFrame:
     """
     计算RS Rating（相对强度评级）
     
     第一性原理：
-    1. 计算每只股票在过去N天的涨跌幅
+    1. 计算每只股票在过去N天的涨跌幅（price_return，见 calculate_price_return）
     2. 将所有股票按涨跌幅排序
     3. 计算百分位排名（0-100）
     """
-    print(f"  -> Calculating RS Rating (lookback: {lookback_period} days)...")
+    print("  -> Calculating RS Rating...")
     
-    # 为每只股票计算收益率
-    def calc_return(group):
-        """计算单只股票的收益率"""
-        if len(group) < lookback_period:
-            return np.nan
-        
-        # 获取最新价格和N天前的价格
-        latest_close = group.iloc[-1]
-        old_close = group.iloc[-lookback_period] if len(group) >= lookback_period else group.iloc[0]
-        
-        if old_close > 0:
-            return ((latest_close - old_close) / old_close) * 100
-        return np.nan
+    # 移除没有收益率数据的股票
+    valid_returns = latest_data['price_return'].dropna()
     
-    # 按股票分组，计算每只股票的收益率
-    df['price_return'] = df.groupby('symbol')['close'].transform(calc_return)
+    if len(valid_returns) == 0:
+        print("  -> ⚠️ No valid stocks for RS Rating calculation")
+        latest_data['rs_rating'] = np.nan
+        return latest_data
     
-    # 对于最新日期，计算RS Rating
-    latest_date = df['date'].max()
-    latest_data = df[df['date'] == latest_date].copy()
+    # 计算百分位排名（核心算法），按索引对齐写回，无收益率的股票保持NaN
+    rs_rating = (valid_returns.rank(pct=True) * 99 + 1).round(1)
+    latest_data['rs_rating'] = rs_rating
     
-    # 移除没有收益率数据的股票
-    valid_stocks = latest_data.dropna(subset=['price_return'])
+    print(f"  -> RS Rating calculated for {len(rs_rating)} stocks")
+    print(f"  -> RS Rating range: {rs_rating.min():.1f} - {rs_rating.max():.1f}")
+    print(f"  -> RS Rating median: {rs_rating.median():.1f}")
     
-    if len(valid_stocks) == 0:
-        print("  -> ⚠️ No valid stocks for RS Rating calculation")
-        df['rs_rating'] = np.nan
-        return df
-    
-    # 计算百分位排名（核心算法）
-    valid_stocks['rs_rating'] = valid_stocks['price_return'].rank(pct=True) * 99 + 1
-    valid_stocks['rs_rating'] = valid_stocks['rs_rating'].round(1)
-    
-    # 合并回原数据
-    df = df.merge(
-        valid_stocks[['symbol', 'rs_rating']],
-        on='symbol',
-        how='left',
-        suffixes=('', '_new')
-    )
+    return latest_data
+
+# daily_metrics 中需要写入的指标列
+FLOAT_METRIC_COLUMNS = [
+    'ma5', 'ma10', 'ma20', 'ma30', 'ma50', 'ma60', 'ma120', 'ma150', 'ma200', 'ma250',
+    'high_52w', 'low_52w', 'rs_rating',
+]
+INT_METRIC_COLUMNS = ['volume_ma10', 'volume_ma30', 'volume_ma60', 'volume_ma90']
+
+METRIC_COLUMNS = ['symbol', 'date'] + FLOAT_METRIC_COLUMNS + INT_METRIC_COLUMNS
+
+def build_metric_frame(target_data: pd.DataFrame) -> pd.DataFrame:
+    """整理目标日期要写入的指标列（价格类四舍五入，成交量均线截断为可空整数）"""
+    out = target_data[['symbol', 'date']].astype(str)
+    for col in FLOAT_METRIC_COLUMNS:
+        out[col] = target_data[col].astype('float64').round(METRIC_DECIMALS)
+    for col in INT_METRIC_COLUMNS:
+        out[col] = np.trunc(target_data[col].astype('float64')).astype('Int64')
+    return out
+
+def build_metric_records(metric_frame: pd.DataFrame) -> list:
+    """把指标表转换为upsert记录（NaN -> None）"""
+    out = metric_frame.astype(object)
+    return out.where(out.notna(), None).to_dict('records')
+
+def copy_daily_metrics(metric_frame: pd.DataFrame):
+    """
+    直连Postgres批量写入：COPY到临时表，再 INSERT ... ON CONFLICT 合并进 daily_metrics
     
-    # 如果有新的rs_rating列，使用它
-    if 'rs_rating_new' in df.columns:
-        df['rs_rating'] = df['rs_rating_new']
-        df.drop('rs_rating_new', axis=1, inplace=True)
+    整个过程在一个事务内完成，不经过PostgREST逐条JSON编码
+    """
+    columns = ', '.join(METRIC_COLUMNS)
+    updates = ', '.join(f"{col} = EXCLUDED.{col}" for col in METRIC_COLUMNS[2:])
     
-    print(f"  -> RS Rating calculated for {len(valid_stocks)} stocks")
-    print(f"  -> RS Rating range: {valid_stocks['rs_rating'].min():.1f} - {valid_stocks['rs_rating'].max():.1f}")
-    print(f"  -> RS Rating median: {valid_stocks['rs_rating'].median():.1f}")
+    buf = io.StringIO()
+    metric_frame[METRIC_COLUMNS].to_csv(buf, index=False, header=False)
+    buf.seek(0)
     
-    return df
+    conn = psycopg2.connect(SUPABASE_DB_URL)
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute(
+                f"CREATE TEMP TABLE daily_metrics_staging ON COMMIT DROP AS "
+                f"SELECT {columns} FROM daily_metrics WITH NO DATA"
+            )
+            cur.copy_expert(f"COPY daily_metrics_staging ({columns}) FROM STDIN WITH (FORMAT csv)", buf)
+            cur.execute(
+                f"INSERT INTO daily_metrics ({columns}) SELECT {columns} FROM daily_metrics_staging "
+                f"ON CONFLICT (symbol, date) DO UPDATE SET {updates}"
+            )
+    finally:
+        conn.close()
+
+def upsert_batch_with_retry(supabase: Client, batch: list):
+    """upsert单个批次，失败时指数退避重试"""
+    for attempt in range(UPSERT_MAX_RETRIES + 1):
+        try:
+            supabase.table('daily_metrics').upsert(batch, on_conflict='symbol,date').execute()
+            return
+        except Exception as e:
+            if attempt == UPSERT_MAX_RETRIES:
+                raise
+            delay = UPSERT_RETRY_DELAY * (2 ** attempt)
+            print(f"  -> ⚠️ Upsert batch failed ({e}), retrying in {delay}s...")
+            time.sleep(delay)
 
 def update_daily_metrics(supabase: Client, df: pd.DataFrame, target_date: str):
     """更新daily_metrics表"""
@@ -159,37 +291,23 @@ def update_daily_metrics(supabase: Client, df: pd.DataFrame, target_date: str):
         print("  -> No data to update")
         return
     
-    # 准备要更新的记录
-    records = []
-    for _, row in target_data.iterrows():
-        record = {
-            'symbol': row['symbol'],
-            'date': row['date'],
-            'ma5': float(row['ma5']) if pd.notna(row['ma5']) else None,
-            'ma10': float(row['ma10']) if pd.notna(row['ma10']) else None,
-            'ma20': float(row['ma20']) if pd.notna(row['ma20']) else None,
-            'ma30': float(row['ma30']) if pd.notna(row['ma30']) else None,
-            'ma50': float(row['ma50']) if pd.notna(row['ma50']) else None,
-            'ma60': float(row['ma60']) if pd.notna(row['ma60']) else None,
-            'ma120': float(row['ma120']) if pd.notna(row['ma120']) else None,
-            'ma150': float(row['ma150']) if pd.notna(row['ma150']) else None,
-            'ma200': float(row['ma200']) if pd.notna(row['ma200']) else None,
-            'ma250': float(row['ma250']) if pd.notna(row['ma250']) else None,
-            'high_52w': float(row['high_52w']) if pd.notna(row['high_52w']) else None,
-            'low_52w': float(row['low_52w']) if pd.notna(row['low_52w']) else None,
-            'rs_rating': float(row['rs_rating']) if pd.notna(row['rs_rating']) else None,
-            'volume_ma10': int(row['volume_ma10']) if pd.notna(row['volume_ma10']) else None,
-            'volume_ma30': int(row['volume_ma30']) if pd.notna(row['volume_ma30']) else None,
-            'volume_ma60': int(row['volume_ma60']) if pd.notna(row['volume_ma60']) else None,
-            'volume_ma90': int(row['volume_ma90']) if pd.notna(row['volume_ma90']) else None,
-        }
-        records.append(record)
-    
-    # 批量更新
-    batch_size = 500
-    for i in range(0, len(records), batch_size):
-        batch = records[i:i+batch_size]
-        supabase.table('daily_metrics').upsert(batch, on_conflict='symbol,date').execute()
+    metric_frame = build_metric_frame(target_data)
+    
+    # 配置了数据库直连时走COPY批量写入
+    if SUPABASE_DB_URL and HAS_PSYCOPG2:
+        copy_daily_metrics(metric_frame)
+        print(f"  -> ✅ Updated {len(metric_frame)} records in daily_metrics (COPY)")
+        return
+    
+    # 准备要更新的记录（整列向量化转换，替代逐行iterrows）
+    records = build_metric_records(metric_frame)
+    
+    # 分批并发更新，单个批次失败只重试该批次
+    batches = [records[i:i + UPSERT_BATCH_SIZE] for i in range(0, len(records), UPSERT_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=UPSERT_MAX_WORKERS) as executor:
+        futures = [executor.submit(upsert_batch_with_retry, supabase, batch) for batch in batches]
+        for future in as_completed(futures):
+            future.result()
     
     print(f"  -> ✅ Updated {len(records)} records in daily_metrics")
 
@@ -202,7 +320,7 @@ def main():
         print("❌ Error: Supabase credentials not found")
         sys.exit(1)
     
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    supabase: Client = create_supabase_client()
     
     # 获取最新交易日
     target_date = get_latest_trading_date(supabase)
@@ -219,27 +337,33 @@ def main():
         # 确保日期格式正确
         df['date'] = pd.to_datetime(df['date']).dt.strftime('%Y-%m-%d')
         
-        # 按symbol和date排序
+        # 按symbol和date排序，之后每只股票是一段连续区间，一次性转换为numpy列数组
         df = df.sort_values(['symbol', 'date'])
+        symbols, offsets, bars = build_symbol_arrays(df)
+        
+        print(f"\n📊 Data loaded: {len(df)} records, {len(symbols)} stocks")
+        del df
         
-        print(f"\n📊 Data loaded: {len(df)} records, {df['symbol'].nunique()} stocks")
+        metrics = {}
         
         # 2. 计算所有移动平均线
         ma_periods = [5, 10, 20, 30, 50, 60, 120, 150, 200, 250]
-        df = calculate_moving_averages(df, ma_periods)
+        metrics.update(calculate_moving_averages(bars['close'], offsets, ma_periods))
         
         # 3. 计算52周高低点
-        df = calculate_52w_high_low(df, window=200)
+        metrics.update(calculate_52w_high_low(bars['high'], bars['low'], offsets, window=200))
         
         # 4. 计算成交量均线
         volume_ma_periods = [10, 30, 60, 90]
-        df = calculate_volume_ma(df, volume_ma_periods)
+        metrics.update(calculate_volume_ma(bars['volume'], offsets, volume_ma_periods))
         
-        # 5. 计算RS Rating（关键！）
-        df = calculate_rs_rating_python(df, lookback_period=60)
+        # 5. 计算RS Rating（关键！）：只取最新交易日的行组装DataFrame后排名
+        metrics['price_return'] = calculate_price_return(bars['close'], offsets, lookback_period=60)
+        df_latest = select_latest_rows(symbols, offsets, bars['date'], metrics)
+        df_latest = calculate_rs_rating_python(df_latest)
         
         # 6. 更新数据库
-        update_daily_metrics(supabase, df, target_date)
+        update_daily_metrics(supabase, df_latest, target_date)
         
         print("\n" + "=" * 70)
         print("✅ All indicators calculated successfully!")
@@ -0,0 +1,95 @@
+# scripts/download_utils.py (下载脚本共用工具)
+"""
+S1/S2/S3 下载脚本共用的 parquet / Baostock 工具函数
+
+- 日期整列格式化、Baostock 字符串转 float64、查询结果读入定长字符串数组
+- 只读 parquet footer 获取最新日期、先写临时文件再原子替换的 parquet 写入
+- 只放与数据目录、日志无关的纯函数；路径拼接和出错时的日志仍由各脚本处理
+"""
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+ROW_FIELD_WIDTH = 32  # 行缓冲中单个字段的初始字符数，遇到更长的字段时整体扩宽，不会截断
+
+
+def format_date_strings(dates):
+    """格式化日期为 YYYY-MM-DD 字符串（整列处理），无法解析的为NaN"""
+    return pd.to_datetime(dates, errors='coerce').dt.strftime('%Y-%m-%d')
+
+
+def to_float_array(values):
+    """Baostock返回的字符串序列 -> float64数组，空字符串/无法解析的值为NaN"""
+    arr = np.asarray(values, dtype=str)
+    try:
+        return np.where(arr == '', 'nan', arr).astype(np.float64)
+    except ValueError:
+        return pd.to_numeric(pd.Series(arr), errors='coerce').to_numpy(dtype=np.float64)
+
+
+def read_rows(rs, start_date, end_date):
+    """
+    把查询结果逐行写入预分配的定长字符串数组，返回 (行数, 字段数) 数组
+
+    行数上界取区间自然日数（交易日不会更多），不够时翻倍扩容；
+    numpy 定长字符串赋值时会静默截断超长内容，因此字段超过当前宽度时先扩宽数组
+    """
+    n_max = (datetime.strptime(end_date, '%Y-%m-%d') - datetime.strptime(start_date, '%Y-%m-%d')).days + 10
+    width = ROW_FIELD_WIDTH
+    rows = np.empty((max(n_max, 10), len(rs.fields)), dtype=f'U{width}')
+    n = 0
+    while (rs.error_code == '0') & rs.next():
+        row = rs.get_row_data()
+        longest = max(map(len, row), default=0)
+        if longest > width:
+            width = max(longest, width * 2)
+            rows = rows.astype(f'U{width}')
+        if n == rows.shape[0]:
+            rows = np.concatenate([rows, np.empty_like(rows)])
+        rows[n] = row
+        n += 1
+    return rows[:n]
+
+
+def read_latest_date(file_path):
+    """
+    读取parquet文件中的最新日期（YYYY-MM-DD），文件不存在或没有数据时返回None，读取出错时抛出异常
+
+    只读footer中各row group的统计信息（不读数据页）；统计信息缺失时只读日期列
+    """
+    if not file_path.exists():
+        return None
+
+    pq_file = pq.ParquetFile(file_path)
+    metadata = pq_file.metadata
+    if metadata.num_rows == 0:
+        return None
+
+    col_idx = pq_file.schema_arrow.get_field_index('日期')
+    maxima = []
+    for i in range(metadata.num_row_groups):
+        stats = metadata.row_group(i).column(col_idx).statistics
+        if stats is None or not stats.has_min_max:
+            maxima = None
+            break
+        maxima.append(stats.max)
+
+    if maxima:
+        latest = max(maxima)
+    else:
+        latest = pd.read_parquet(file_path, columns=['日期'])['日期'].max()
+
+    # 日期按 YYYY-MM-DD 字符串存储，统计值可直接返回
+    if isinstance(latest, str) and len(latest) == 10 and latest[4] == latest[7] == '-':
+        return latest
+    return pd.to_datetime(latest).strftime('%Y-%m-%d')
+
+
+def write_parquet_atomic(df, file_path, write_options):
+    """先写临时文件再原子替换：旧文件（及其硬链接备份）内容保持不变，写到一半中断也不会留下损坏文件"""
+    tmp_path = file_path.with_name(file_path.name + '.tmp')
+    df.to_parquet(tmp_path, index=False, **write_options)
+    os.replace(tmp_path, file_path)
@@ -0,0 +1,469 @@
+# scripts/numba_kernels.py (Numba JIT 指标内核)
+"""
+技术指标的 Numba 编译内核
+
+替代 pandas rolling / MyTT 中 MA、HHV、LLV 等逐序列调用：
+- 多周期内核（rolling_means / rolling_extremes）：一次遍历算出同一序列的多个周期，返回 (周期数, 行数) 数组
+  （窗口不足或窗口内有NaN时为NaN，与 pandas rolling(min_periods=window) 一致）；均线与 pandas rolling().mean() 逐位一致
+- 指数平滑内核（macd / kdj）：按 pandas ewm(adjust=False) 的递推公式逐步计算（含NaN处理），多条均线共用一次遍历，结果与 pandas 逐位一致
+- 多周期内核与指数平滑内核运行时释放GIL（nogil），可在线程池中多个文件并行计算
+- 末值内核（grouped_last_*）：数据已按 (symbol, date) 排序，offsets[g]:offsets[g+1] 为第g只股票的区间；
+  只算每只股票最后一根K线的指标值，供只写最新交易日的场景使用，各股票互不依赖，用 prange 多线程并行
+- 日线派生字段内核（derive_daily_fields / derive_index_fields）：一次遍历算出昨收、涨跌额、振幅、异常/停牌标记（指数另含多周期收益率）
+- 未安装 numba 时优先用 TA-Lib 的C内核，其次退回 sliding_window_view 向量化实现，接口与结果一致
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# 尝试导入 numba
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+    prange = range
+
+# 尝试导入 TA-Lib（仅在无 numba 时使用）
+try:
+    import talib
+    HAS_TALIB = True
+except ImportError:
+    HAS_TALIB = False
+
+
+@njit(cache=True)
+def _rolling_extreme(values, window, is_max):
+    """N日最高/最低值（单调队列，O(n)）"""
+    n = values.shape[0]
+    out = np.full(n, np.nan)
+    queue = np.empty(n, dtype=np.int64)  # 存放下标，对应的值单调
+    head = 0
+    tail = 0
+    nan_count = 0
+    for i in range(n):
+        x = values[i]
+        if np.isnan(x):
+            nan_count += 1
+        else:
+            while tail > head and ((values[queue[tail - 1]] <= x) if is_max else (values[queue[tail - 1]] >= x)):
+                tail -= 1
+            queue[tail] = i
+            tail += 1
+        if i >= window and np.isnan(values[i - window]):
+            nan_count -= 1
+        while tail > head and queue[head] <= i - window:
+            head += 1
+        if i >= window - 1 and nan_count == 0:
+            out[i] = values[queue[head]]
+    return out
+
+
+@njit(cache=True)
+def _fused_rolling_extreme(values, windows, is_max, out):
+    """一次遍历同时计算多个窗口的N日最高/最低值：每个窗口各一个单调队列"""
+    n = values.shape[0]
+    k = windows.shape[0]
+    queues = np.empty((k, n), dtype=np.int64)
+    heads = np.zeros(k, dtype=np.int64)
+    tails = np.zeros(k, dtype=np.int64)
+    nan_counts = np.zeros(k, dtype=np.int64)
+    for i in range(n):
+        x = values[i]
+        x_is_nan = np.isnan(x)
+        for j in range(k):
+            window = windows[j]
+            if x_is_nan:
+                nan_counts[j] += 1
+            else:
+                while tails[j] > heads[j] and ((values[queues[j, tails[j] - 1]] <= x) if is_max else (values[queues[j, tails[j] - 1]] >= x)):
+                    tails[j] -= 1
+                queues[j, tails[j]] = i
+                tails[j] += 1
+            if i >= window and np.isnan(values[i - window]):
+                nan_counts[j] -= 1
+            while tails[j] > heads[j] and queues[j, heads[j]] <= i - window:
+                heads[j] += 1
+            if i >= window - 1 and nan_counts[j] == 0:
+                out[j, i] = values[queues[j, heads[j]]]
+            else:
+                out[j, i] = np.nan
+
+
+@njit(cache=True, nogil=True)
+def rolling_extremes(high, low, windows):
+    """多个窗口的N日最高值（取自high）和最低值（取自low），返回两个 (窗口数, 行数) 数组"""
+    highs = np.empty((windows.shape[0], high.shape[0]))
+    lows = np.empty((windows.shape[0], low.shape[0]))
+    _fused_rolling_extreme(high, windows, True, highs)
+    _fused_rolling_extreme(low, windows, False, lows)
+    return highs, lows
+
+
+@njit(cache=True)
+def _fused_rolling_means(values, windows, out):
+    """
+    一次遍历同时计算多个周期的均线：每个值只读取一次，更新所有周期的滑动和
+    
+    与 pandas rolling().mean() 的算法逐位一致：先移出再移入、加减各自做Kahan补偿，
+    窗口内全为同一值时直接取该值，全非负（全非正）时结果不会因舍入误差变号
+    """
+    n = values.shape[0]
+    k = windows.shape[0]
+    totals = np.zeros(k)
+    comp_add = np.zeros(k)
+    comp_remove = np.zeros(k)
+    nobs = np.zeros(k, dtype=np.int64)
+    neg_counts = np.zeros(k, dtype=np.int64)
+    same_counts = np.zeros(k, dtype=np.int64)
+    prev_values = np.full(k, np.nan)
+    for i in range(n):
+        x = values[i]
+        for j in range(k):
+            window = windows[j]
+            if i >= window:
+                old = values[i - window]
+                if not np.isnan(old):
+                    nobs[j] -= 1
+                    y = -old - comp_remove[j]
+                    t = totals[j] + y
+                    comp_remove[j] = t - totals[j] - y
+                    totals[j] = t
+                    if np.signbit(old):
+                        neg_counts[j] -= 1
+            if not np.isnan(x):
+                nobs[j] += 1
+                y = x - comp_add[j]
+                t = totals[j] + y
+                comp_add[j] = t - totals[j] - y
+                totals[j] = t
+                if np.signbit(x):
+                    neg_counts[j] += 1
+                if x == prev_values[j]:
+                    same_counts[j] += 1
+                else:
+                    same_counts[j] = 1
+                prev_values[j] = x
+            if nobs[j] >= window:
+                mean = totals[j] / nobs[j]
+                if same_counts[j] >= nobs[j]:
+                    mean = prev_values[j]
+                elif neg_counts[j] == 0 and mean < 0:
+                    mean = 0.0
+                elif neg_counts[j] == nobs[j] and mean > 0:
+                    mean = 0.0
+                out[j, i] = mean
+            else:
+                out[j, i] = np.nan
+
+
+@njit(cache=True, nogil=True)
+def rolling_means(values, windows):
+    """单序列一次遍历计算多个周期的均线，返回 (周期数, 行数) 数组"""
+    out = np.empty((windows.shape[0], values.shape[0]))
+    _fused_rolling_means(values, windows, out)
+    return out
+
+
+@njit(parallel=True, cache=True)
+def grouped_last_means(values, offsets, windows):
+    """
+    只计算每只股票最后一根K线的多周期均线，返回 (周期数, 股票数) 数组
+    
+    从最后一根K线往前累加一次，累加到某个周期长度时记录该周期的均值；遇到NaN即停止（更长的窗口都含NaN）
+    """
+    n_groups = offsets.shape[0] - 1
+    k = windows.shape[0]
+    out = np.full((k, n_groups), np.nan)
+    max_window = windows.max()
+    for g in prange(n_groups):
+        start, end = offsets[g], offsets[g + 1]
+        total = 0.0
+        count = 0
+        for i in range(end - 1, max(start, end - max_window) - 1, -1):
+            x = values[i]
+            if np.isnan(x):
+                break
+            total += x
+            count += 1
+            for j in range(k):
+                if windows[j] == count:
+                    out[j, g] = total / count
+    return out
+
+
+@njit(parallel=True, cache=True)
+def _grouped_last_extreme(values, offsets, window, is_max):
+    n_groups = offsets.shape[0] - 1
+    out = np.full(n_groups, np.nan)
+    for g in prange(n_groups):
+        start, end = offsets[g], offsets[g + 1]
+        if end - start < window:
+            continue
+        best = values[end - 1]
+        for i in range(end - window, end):
+            x = values[i]
+            if np.isnan(x):
+                best = np.nan
+                break
+            if (x > best) if is_max else (x < best):
+                best = x
+        out[g] = best
+    return out
+
+
+@njit(cache=True)
+def grouped_last_max(values, offsets, window):
+    """只计算每只股票最后一根K线的N日最高值"""
+    return _grouped_last_extreme(values, offsets, window, True)
+
+
+@njit(cache=True)
+def grouped_last_min(values, offsets, window):
+    """只计算每只股票最后一根K线的N日最低值"""
+    return _grouped_last_extreme(values, offsets, window, False)
+
+def ewm_alpha(span=None, alpha=None):
+    """按 pandas ewm 的换算方式得到平滑系数（span/alpha 先换算为 com，再取 1/(1+com)），保证与 pandas 逐位一致"""
+    com = (span - 1) / 2.0 if span is not None else (1.0 - alpha) / alpha
+    return 1.0 / (1.0 + com)
+
+
+@njit(cache=True)
+def _ewm_update(weighted, old_wt, x, alpha):
+    """
+    pandas ewm(adjust=False, ignore_na=False) 的单步递推，返回 (新的均值, 旧值权重)；NaN处沿用上一个均值
+    
+    不改用 (1-α)^k 权重的闭式展开（点积/卷积）：舍入顺序与 pandas 不同，
+    取整后的 MACD/KDJ 会在末位 5 的边界上翻转；递推本身每步 O(1)，也没有可省的计算
+    """
+    if np.isnan(weighted):
+        if np.isnan(x):
+            return weighted, old_wt
+        return x, 1.0
+    old_wt *= 1.0 - alpha
+    if not np.isnan(x):
+        if weighted != x:
+            weighted = (old_wt * weighted + alpha * x) / (old_wt + alpha)
+        old_wt = 1.0
+    return weighted, old_wt
+
+
+@njit(cache=True, nogil=True, error_model='numpy')
+def macd(close, alpha_fast, alpha_slow, alpha_signal):
+    """一次遍历算出 MACD 的 DIF、DEA 和柱（DIF - DEA），三条指数均线各保留一份递推状态"""
+    n = close.shape[0]
+    dif = np.empty(n)
+    dea = np.empty(n)
+    bar = np.empty(n)
+    fast = slow = signal = np.nan
+    fast_wt = slow_wt = signal_wt = 1.0
+    for i in range(n):
+        fast, fast_wt = _ewm_update(fast, fast_wt, close[i], alpha_fast)
+        slow, slow_wt = _ewm_update(slow, slow_wt, close[i], alpha_slow)
+        dif[i] = fast - slow
+        signal, signal_wt = _ewm_update(signal, signal_wt, dif[i], alpha_signal)
+        dea[i] = signal
+        bar[i] = dif[i] - signal
+    return dif, dea, bar
+
+
+@njit(cache=True, nogil=True, error_model='numpy')
+def kdj(high, low, close, n, alpha_k, alpha_d):
+    """KDJ：N日最高/最低（单调队列）得到RSV，随后一次遍历递推K、D（ewm(adjust=False)）并算出J"""
+    high_max = _rolling_extreme(high, n, True)
+    low_min = _rolling_extreme(low, n, False)
+    size = close.shape[0]
+    k_out = np.empty(size)
+    d_out = np.empty(size)
+    j_out = np.empty(size)
+    k = d = np.nan
+    k_wt = d_wt = 1.0
+    for i in range(size):
+        rsv = (close[i] - low_min[i]) / (high_max[i] - low_min[i]) * 100
+        k, k_wt = _ewm_update(k, k_wt, rsv, alpha_k)
+        d, d_wt = _ewm_update(d, d_wt, k, alpha_d)
+        k_out[i] = k
+        d_out[i] = d
+        j_out[i] = 3 * k - 2 * d
+    return k_out, d_out, j_out
+
+
+@njit(cache=True, error_model='numpy')
+def derive_daily_fields(close, high, low, pct_change, volume):
+    """
+    单只股票日线派生字段（数据已按日期排序），返回 (昨收, 涨跌额, 振幅, 涨跌幅异常, 停牌)
+    
+    振幅 = (最高 - 最低) / 昨收 * 100，保留4位小数；|涨跌幅| > 10 为异常；成交量为0为停牌（NaN均为False）
+    """
+    n = close.shape[0]
+    prev_close = np.empty(n)
+    change = np.empty(n)
+    amplitude = np.empty(n)
+    abnormal = np.empty(n, dtype=np.bool_)
+    halted = np.empty(n, dtype=np.bool_)
+    prev = np.nan
+    for i in range(n):
+        prev_close[i] = prev
+        change[i] = close[i] - prev
+        amplitude[i] = np.round((high[i] - low[i]) / prev * 100, 4)
+        abnormal[i] = abs(pct_change[i]) > 10
+        halted[i] = volume[i] == 0
+        prev = close[i]
+    return prev_close, change, amplitude, abnormal, halted
+
+@njit(cache=True, error_model='numpy')
+def derive_index_fields(close, high, low, pct_change, prev_close, shift_prev, periods, abnormal_threshold):
+    """
+    单个指数日线派生字段（数据已按日期排序），返回 (昨收, 涨跌额, 振幅, 波动异常, 收益率)
+    
+    shift_prev 为 True 时昨收取前一行收盘，否则沿用传入的 prev_close；
+    收益率为 (周期数, 行数) 数组，第j行 = (收盘 / N日前收盘 - 1) * 100，N = periods[j]
+    """
+    n = close.shape[0]
+    k = periods.shape[0]
+    prev_out = np.empty(n)
+    change = np.empty(n)
+    amplitude = np.empty(n)
+    abnormal = np.empty(n, dtype=np.bool_)
+    returns = np.full((k, n), np.nan)
+    for i in range(n):
+        if shift_prev:
+            prev = close[i - 1] if i > 0 else np.nan
+        else:
+            prev = prev_close[i]
+        prev_out[i] = prev
+        change[i] = close[i] - prev
+        amplitude[i] = np.round((high[i] - low[i]) / prev * 100, 4)
+        abnormal[i] = abs(pct_change[i]) > abnormal_threshold
+        for j in range(k):
+            period = periods[j]
+            if i >= period:
+                returns[j, i] = (close[i] / close[i - period] - 1) * 100
+    return prev_out, change, amplitude, abnormal, returns
+
+# ============================================================
+# 无 numba 时的向量化实现：窗口视图为零拷贝二维视图，每行一次归约
+# ============================================================
+
+def _window_reduce(values, window, reducer):
+    out = np.full(values.shape[0], np.nan)
+    if values.shape[0] >= window:
+        out[window - 1:] = reducer(sliding_window_view(values, window), axis=1)
+    return out
+
+
+def _fast_hhv(values, window):
+    return _window_reduce(values, window, np.max)
+
+
+def _fast_llv(values, window):
+    return _window_reduce(values, window, np.min)
+
+
+def _with_talib(fast_kernel, talib_func):
+    """优先调用TA-Lib；序列中有NaN时TA-Lib的处理与 rolling(min_periods=window) 不一致，退回向量化实现"""
+    def kernel(values, window):
+        x = np.ascontiguousarray(values, dtype=np.float64)  # TA-Lib 要求连续的float64
+        if window < 2 or x.shape[0] < window or np.isnan(x).any():
+            return fast_kernel(values, window)
+        return talib_func(x, timeperiod=window)
+    return kernel
+
+
+if not HAS_NUMBA and HAS_TALIB:
+    _fast_hhv = _with_talib(_fast_hhv, talib.MAX)
+    _fast_llv = _with_talib(_fast_llv, talib.MIN)
+
+
+def _last_windows(values, offsets, window):
+    """把每只股票最后window根K线取成 (股票数, window) 矩阵，历史不足的行整行为NaN"""
+    starts, ends = offsets[:-1], offsets[1:]
+    idx = ends[:, None] - window + np.arange(window)
+    has_history = ends - starts >= window
+    windows = values[np.where(has_history[:, None], idx, 0)].astype(np.float64)
+    windows[~has_history] = np.nan
+    return windows
+
+
+def _fast_last_means(values, offsets, windows):
+    return np.stack([_last_windows(values, offsets, window).mean(axis=1) for window in windows])
+
+
+def _fast_last_max(values, offsets, window):
+    return _last_windows(values, offsets, window).max(axis=1)
+
+
+def _fast_last_min(values, offsets, window):
+    return _last_windows(values, offsets, window).min(axis=1)
+
+
+def _fast_means(values, windows):
+    # 整列输出的均线要与 pandas 逐位一致（舍入到2位小数时不出现 .xx5 边界翻转），直接用 pandas rolling
+    import pandas as pd
+    series = pd.Series(values)
+    return np.stack([series.rolling(window).mean().to_numpy() for window in windows.tolist()]).reshape(len(windows), -1)
+
+
+def _fast_macd(close, alpha_fast, alpha_slow, alpha_signal):
+    import pandas as pd
+    series = pd.Series(close)
+    dif = series.ewm(alpha=alpha_fast, adjust=False).mean() - series.ewm(alpha=alpha_slow, adjust=False).mean()
+    dea = dif.ewm(alpha=alpha_signal, adjust=False).mean()
+    return dif.to_numpy(), dea.to_numpy(), (dif - dea).to_numpy()
+
+
+def _fast_kdj(high, low, close, n, alpha_k, alpha_d):
+    import pandas as pd
+    low_min = pd.Series(low).rolling(window=n).min()
+    high_max = pd.Series(high).rolling(window=n).max()
+    rsv = (pd.Series(close) - low_min) / (high_max - low_min) * 100
+    k = rsv.ewm(alpha=alpha_k, adjust=False).mean()
+    d = k.ewm(alpha=alpha_d, adjust=False).mean()
+    return k.to_numpy(), d.to_numpy(), (3 * k - 2 * d).to_numpy()
+
+
+def _fast_extremes(high, low, windows):
+    highs = np.empty((len(windows), high.shape[0]))
+    lows = np.empty((len(windows), low.shape[0]))
+    for j, window in enumerate(windows.tolist()):
+        highs[j] = _fast_hhv(high, window)
+        lows[j] = _fast_llv(low, window)
+    return highs, lows
+
+
+def _fast_derive_daily_fields(close, high, low, pct_change, volume):
+    prev_close = np.empty_like(close)
+    prev_close[:1] = np.nan
+    prev_close[1:] = close[:-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        amplitude = np.round((high - low) / prev_close * 100, 4)
+        return prev_close, close - prev_close, amplitude, np.abs(pct_change) > 10, volume == 0
+
+
+def _fast_derive_index_fields(close, high, low, pct_change, prev_close, shift_prev, periods, abnormal_threshold):
+    if shift_prev:
+        prev_close = np.empty_like(close)
+        prev_close[:1] = np.nan
+        prev_close[1:] = close[:-1]
+    returns = np.full((periods.shape[0], close.shape[0]), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        amplitude = np.round((high - low) / prev_close * 100, 4)
+        for j, period in enumerate(periods.tolist()):
+            returns[j, period:] = (close[period:] / close[:close.shape[0] - period] - 1) * 100
+        return prev_close, close - prev_close, amplitude, np.abs(pct_change) > abnormal_threshold, returns
+
+
+if not HAS_NUMBA:
+    derive_daily_fields = _fast_derive_daily_fields
+    derive_index_fields = _fast_derive_index_fields
+    rolling_means = _fast_means
+    rolling_extremes = _fast_extremes
+    macd = _fast_macd
+    kdj = _fast_kdj
+    grouped_last_means = _fast_last_means
+    grouped_last_max = _fast_last_max
+    grouped_last_min = _fast_last_min